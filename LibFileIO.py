@@ -0,0 +1,270 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QTextCursor, QTextDocument
+from PyQt6.QtWidgets import QPlainTextEdit, QApplication
+import functools
+import io
+import os
+import shutil
+import tempfile
+import time
+
+
+# noinspection PyUnresolvedReferences
+class ChunkedFileLoader(QObject):
+    chunk_chars = 64 * 1024
+
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, editor: QPlainTextEdit, parent=None):
+        super().__init__(parent)
+        self.__editor = editor
+        self.__file: io.TextIOWrapper | None = None
+        self.__file_size = 0
+        self.__cursor: QTextCursor | None = None
+
+        # One chunk per event loop pass keeps the window responsive
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(0)
+        self.__timer.timeout.connect(self.__load_chunk)
+
+    def is_loading(self):
+        return self.__file is not None
+
+    def load(self, filename: str, encoding: str):
+        # The text wrapper decodes incrementally and translates newlines
+        # across chunk borders the same way a full read does.
+        self.__file = open(filename, "r", encoding=encoding, errors="ignore")
+        self.__file_size = os.fstat(self.__file.fileno()).st_size
+
+        # Loading is not an undoable edit, and the undo stack would hold
+        # another copy of the text.
+        self.__editor.setUndoRedoEnabled(False)
+        self.__editor.clear()
+        self.__cursor = QTextCursor(self.__editor.document())
+        self.progress.emit(0)
+        self.__timer.start()
+
+    def __load_chunk(self):
+        try:
+            text = self.__file.read(self.chunk_chars)
+        except OSError as e:
+            self.__stop()
+            self.failed.emit(f"Cannot read the file: {e.strerror}")
+            return
+
+        if len(text) == 0:
+            self.__stop()
+            self.progress.emit(100)
+            self.finished.emit()
+            return
+
+        self.__cursor.movePosition(QTextCursor.MoveOperation.End)
+        self.__cursor.insertText(text)
+        if self.__file_size > 0:
+            self.progress.emit(min(99, int(self.__file.buffer.tell() * 100 / self.__file_size)))
+
+    def __stop(self):
+        self.__timer.stop()
+        self.__file.close()
+        self.__file = None
+        self.__cursor = None
+        self.__editor.setUndoRedoEnabled(True)
+
+
+# noinspection PyUnresolvedReferences
+class SaveWorker(QObject):
+    # request id, path, bytes written, seconds, mode
+    saved = pyqtSignal(int, str, int, float, str)
+    failed = pyqtSignal(int, str, str)
+
+    def __init__(self):
+        super().__init__()
+        # Read by the GUI thread when shutting down
+        self.completed_request_id = 0
+        # Bytes and on-disk size/mtime of the last file this worker wrote
+        self.__last_path = ""
+        self.__last_data = b""
+        self.__last_stat: tuple[int, int] | None = None
+
+    def save(self, request_id: int, path: str, text: str, encoding: str):
+        start_time = time.perf_counter()
+        data = text.encode(encoding, "ignore")
+        try:
+            mode, n_written = self.__write(path, data)
+        except OSError as e:
+            self.__last_stat = None
+            self.completed_request_id = request_id
+            self.failed.emit(request_id, path, f"Cannot save {path}: {e.strerror}")
+            return
+        self.completed_request_id = request_id
+        self.saved.emit(request_id, path, n_written, time.perf_counter() - start_time, mode)
+
+    def __write(self, path: str, data: bytes):
+        if self.__is_unchanged_on_disk(path) and data.startswith(self.__last_data):
+            if len(data) == len(self.__last_data):
+                return "unchanged", 0
+            # Only text was added at the end: append it, the existing
+            # content is never touched.
+            with open(path, "ab") as file:
+                file.write(data[len(self.__last_data):])
+                file.flush()
+                os.fsync(file.fileno())
+            mode, n_written = "append", len(data) - len(self.__last_data)
+        else:
+            self.__write_atomic(path, data)
+            mode, n_written = "rewrite", len(data)
+
+        stat = os.stat(path)
+        self.__last_path = path
+        self.__last_data = data
+        self.__last_stat = (stat.st_size, stat.st_mtime_ns)
+        return mode, n_written
+
+    def __is_unchanged_on_disk(self, path: str):
+        if path != self.__last_path or self.__last_stat is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == self.__last_stat
+
+    @staticmethod
+    def __write_atomic(path: str, data: bytes):
+        # Write a temporary file next to the target and rename it over the
+        # target, so the file on disk is always either old or new.
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".",
+                                         suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(path):
+                shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+class SaveRequests:
+    # The save the worker thread runs and the one waiting for it, as
+    # (request id, path, text, encoding, edit generation). Whoever stops the
+    # thread finishes them.
+    def __init__(self):
+        self.last_id = 0
+        self.in_flight: tuple[int, str, str, str, int] | None = None
+        self.pending: tuple[int, str, str, str, int] | None = None
+        self.stopped = False
+
+
+# noinspection PyUnresolvedReferences
+class SaveEngine(QObject):
+    # path, bytes written, seconds, mode, edit generation of the snapshot
+    saved = pyqtSignal(str, int, float, str, int)
+    # path, message, edit generation of the snapshot
+    failed = pyqtSignal(str, str, int)
+    __save_requested = pyqtSignal(int, str, str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.last_save_seconds = 0.0
+        self.last_bytes_written = 0
+
+        self.__requests = SaveRequests()
+
+        # Create thread: QThread, worker: QObject
+        self.__save_thread = QThread(self)
+        self.__save_worker = SaveWorker()
+        self.__save_worker.moveToThread(self.__save_thread)
+        self.__save_requested.connect(self.__save_worker.save)
+        self.__save_worker.saved.connect(self.__receive_saved)
+        self.__save_worker.failed.connect(self.__receive_failed)
+        QApplication.instance().aboutToQuit.connect(self.__stop_save_thread)
+        # The engine may go before the application does. Its own slots are
+        # gone by then, so this one only holds what it stops and finishes.
+        self.destroyed.connect(functools.partial(self.__stop_thread, self.__save_thread, self.__save_worker,
+                                                 self.__requests))
+        self.__save_thread.start()
+
+    def is_busy(self):
+        return self.__requests.in_flight is not None
+
+    def save(self, path: str, document: QTextDocument, encoding: str, generation: int = 0):
+        # Snapshot on the GUI thread, encode and write on the worker thread.
+        # Saves requested while one is running collapse into the latest.
+        requests = self.__requests
+        requests.last_id += 1
+        requests.pending = (requests.last_id, path, document.toPlainText(), encoding, generation)
+        if requests.in_flight is None:
+            self.__dispatch_pending()
+
+    def __dispatch_pending(self):
+        requests = self.__requests
+        requests.in_flight, requests.pending = requests.pending, None
+        self.__save_requested.emit(*requests.in_flight[:4])
+
+    def __finish_request(self, request_id: int):
+        # The edit generation of the save, None if it is no longer in flight
+        requests = self.__requests
+        if requests.in_flight is None or requests.in_flight[0] != request_id:
+            return None
+        generation = requests.in_flight[4]
+        requests.in_flight = None
+        if requests.pending is not None and not requests.stopped:
+            self.__dispatch_pending()
+        return generation
+
+    def __receive_saved(self, request_id: int, path: str, n_written: int, seconds: float, mode: str):
+        generation = self.__finish_request(request_id)
+        if generation is None:
+            return
+        self.last_save_seconds = seconds
+        self.last_bytes_written = n_written
+        self.saved.emit(path, n_written, seconds, mode, generation)
+
+    def __receive_failed(self, request_id: int, path: str, message: str):
+        generation = self.__finish_request(request_id)
+        if generation is None:
+            return
+        self.failed.emit(path, message, generation)
+
+    def __stop_save_thread(self):
+        self.__stop_thread(self.__save_thread, self.__save_worker, self.__requests)
+
+    @staticmethod
+    def __stop_thread(save_thread: QThread, save_worker: SaveWorker, requests: SaveRequests):
+        save_thread.quit()
+        save_thread.wait()
+
+        # Finish saves the worker thread did not get to before it stopped,
+        # right here, as nothing is dispatched to it any more
+        requests.stopped = True
+        if requests.in_flight is not None and save_worker.completed_request_id != requests.in_flight[0]:
+            save_worker.save(*requests.in_flight[:4])
+        if requests.pending is not None:
+            requests.in_flight, requests.pending = requests.pending, None
+            save_worker.save(*requests.in_flight[:4])
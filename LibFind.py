@@ -30,7 +30,7 @@ LibFind.py
 
 """
 
-from PyQt6 import QtCore, QtWidgets, QtGui
+from PyQt6 import QtWidgets, QtGui
 from PyQt6.QtGui import QTextCursor, QTextDocument
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import (
@@ -38,6 +38,7 @@ from PyQt6.QtWidgets import (
     QVBoxLayout, QWidget, QPushButton, QDialogButtonBox,
     QHBoxLayout, QPlainTextEdit
 )
+from LibSearch import IncrementalSearch, InvalidPatternError, MatchIndex, find_next, search_flags
 
 
 # noinspection PyUnresolvedReferences
@@ -60,6 +61,18 @@ class FindDialog(QDialog):
         self.fromStartCheckBox.setChecked(True)
         self.regexCheckBox = QCheckBox("Regex")
         self.regexCheckBox.setChecked(False)
+        self.highlightCheckBox = QCheckBox("&Highlight all")
+        self.highlightCheckBox.setChecked(False)
+        self.incrementalCheckBox = QCheckBox("Search as you &type")
+        self.incrementalCheckBox.setChecked(False)
+        self.matchLabel = QLabel()
+
+        # Built once highlighting or searching as you type is first checked,
+        # plain finds need neither the index nor its search thread
+        self.match_index: MatchIndex | None = None
+        self.incremental_search: IncrementalSearch | None = None
+        # Query and flags the match index was built for
+        self.__indexed_query = None
 
         self.findButton = QPushButton("&Find")
         self.findButton.clicked.connect(self.find)
@@ -81,6 +94,12 @@ class FindDialog(QDialog):
         self.buttonBox.addButton(self.moreButton, QDialogButtonBox.ButtonRole.ActionRole)
 
         self.regexCheckBox.toggled.connect(self.regex_mode)
+        self.highlightCheckBox.toggled.connect(self.__highlight_toggled)
+        self.incrementalCheckBox.toggled.connect(self.__incremental_toggled)
+        self.lineEdit.textChanged.connect(self.__query_edited)
+        self.caseCheckBox.toggled.connect(self.__query_edited)
+        self.regexCheckBox.toggled.connect(self.__query_edited)
+        self.wholeWordsCheckBox.toggled.connect(self.__query_edited)
         self.moreButton.toggled.connect(self.extension.setVisible)
 
         extension_layout = QVBoxLayout()
@@ -99,6 +118,9 @@ class FindDialog(QDialog):
         left_layout.addWidget(self.caseCheckBox)
         left_layout.addWidget(self.regexCheckBox)
         left_layout.addWidget(self.fromStartCheckBox)
+        left_layout.addWidget(self.highlightCheckBox)
+        left_layout.addWidget(self.incrementalCheckBox)
+        left_layout.addWidget(self.matchLabel)
 
         main_layout = QGridLayout()
         main_layout.setSizeConstraint(QtWidgets.QLayout.SizeConstraint.SetFixedSize)
@@ -113,9 +135,6 @@ class FindDialog(QDialog):
         self.extension.hide()
 
     def find(self):
-        query = self.lineEdit.text()
-        re = QtCore.QRegularExpression()
-
         find_editor = self.search_editor
 
         if self.fromStartCheckBox.isChecked():
@@ -124,35 +143,91 @@ class FindDialog(QDialog):
             find_editor.setTextCursor(cursor)
         self.fromStartCheckBox.setChecked(False)
 
-        if self.regexCheckBox.isChecked():
-            re.setPattern(query)
-            if self.backwardCheckBox.isChecked():
-                self.last_match = find_editor.find(re, QTextDocument.FindFlag.FindBackward)
-            else:
-                self.last_match = find_editor.find(re, QTextDocument.FindFlag(0))
-
         if self.searchSelectionCheckBox.isChecked():
-            query = find_editor.textCursor().selectedText()
-            find_editor.find(query)
-        else:
-            if self.backwardCheckBox.isChecked():
-                flags = QTextDocument.FindFlag.FindBackward
-                if self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords | QTextDocument.FindFlag.FindCaseSensitively
-                elif self.wholeWordsCheckBox.isChecked() and not self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords
-                elif not self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindCaseSensitively
+            # Look for the next occurrence of the selected text
+            self.last_match = find_next(find_editor, find_editor.textCursor().selectedText())
+            return
+
+        flags = search_flags(self.caseCheckBox.isChecked(), self.wholeWordsCheckBox.isChecked(),
+                             self.backwardCheckBox.isChecked())
+        try:
+            if self.highlightCheckBox.isChecked() or self.incrementalCheckBox.isChecked():
+                self.__find_indexed(flags)
             else:
-                flags = QTextDocument.FindFlag(0)
-                if self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords | QTextDocument.FindFlag.FindCaseSensitively
-                elif self.wholeWordsCheckBox.isChecked() and not self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords
-                elif not self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindCaseSensitively
-
-            self.last_match = find_editor.find(query, flags)
+                self.matchLabel.clear()
+                self.last_match = find_next(find_editor, self.lineEdit.text(),
+                                            self.regexCheckBox.isChecked(), flags)
+        except InvalidPatternError as e:
+            self.last_match = False
+            self.matchLabel.setText(str(e))
+
+    def __find_indexed(self, flags: QTextDocument.FindFlag):
+        # The index is built once per query and then kept up to date
+        indexed_query = (self.lineEdit.text(), flags & ~QTextDocument.FindFlag.FindBackward,
+                         self.regexCheckBox.isChecked())
+        if indexed_query != self.__indexed_query:
+            self.__indexed_query = None
+            self.__create_match_index().set_query(*indexed_query)
+            self.__indexed_query = indexed_query
+        self.last_match = self.match_index.step(self.backwardCheckBox.isChecked())
+
+    def __create_match_index(self):
+        if self.match_index is None:
+            self.match_index = MatchIndex(self.search_editor, self)
+            self.match_index.changed.connect(self.__update_match_label)
+        return self.match_index
+
+    def __create_incremental_search(self):
+        if self.incremental_search is None:
+            self.incremental_search = IncrementalSearch(self.search_editor, self.__create_match_index(), self)
+            self.incremental_search.failed.connect(self.matchLabel.setText)
+        return self.incremental_search
+
+    def __highlight_toggled(self, checked: bool):
+        if checked:
+            self.__create_match_index()
+        elif not self.incrementalCheckBox.isChecked() and self.match_index is not None:
+            self.match_index.clear()
+            self.__indexed_query = None
+
+    def __incremental_toggled(self, checked: bool):
+        if checked:
+            self.__create_incremental_search()
+            self.__query_edited()
+            return
+        self.incremental_search.cancel()
+        if not self.highlightCheckBox.isChecked():
+            self.match_index.clear()
+        self.__indexed_query = None
+
+    def __query_edited(self):
+        if not self.incrementalCheckBox.isChecked():
+            return
+        # Find steps through the matches of the scan
+        self.__indexed_query = (self.lineEdit.text(),
+                                search_flags(self.caseCheckBox.isChecked(), self.wholeWordsCheckBox.isChecked()),
+                                self.regexCheckBox.isChecked())
+        self.incremental_search.search(*self.__indexed_query)
+
+    def __update_match_label(self):
+        if not self.match_index.is_active():
+            self.matchLabel.clear()
+        elif self.match_index.is_loading():
+            self.matchLabel.setText(f"Searching... {self.match_index.count()} matches")
+        elif self.match_index.count() == 0:
+            self.matchLabel.setText("No matches")
+        elif self.match_index.current() < 0:
+            self.matchLabel.setText(f"{self.match_index.count()} matches")
+        else:
+            self.matchLabel.setText(f"{self.match_index.current() + 1} of {self.match_index.count()}")
+
+    def hideEvent(self, event: QtGui.QHideEvent):
+        if self.incremental_search is not None:
+            self.incremental_search.cancel()
+        if self.match_index is not None:
+            self.match_index.clear()
+        self.__indexed_query = None
+        super().hideEvent(event)
 
     def regex_mode(self):
         self.caseCheckBox.setChecked(False)
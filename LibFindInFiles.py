@@ -0,0 +1,485 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6 import QtGui, QtWidgets
+from PyQt6.QtCore import QObject, QThread, Qt, pyqtSignal
+from PyQt6.QtGui import QTextDocument
+from PyQt6.QtWidgets import (
+    QApplication, QFileDialog, QHBoxLayout, QLabel, QLineEdit,
+    QListWidget, QListWidgetItem, QPlainTextEdit, QPushButton
+)
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+
+from LibFind import FindDialog
+from LibSearch import InvalidPatternError, search_flags, valid_query
+
+draft_extensions = (".md", ".txt")
+index_directory = "assets/find_in_files"
+
+# Every CJK character is a token, like in the word count; so is every run
+# of other letters and digits.
+token_pattern = re.compile(r'[一-龥]|[^\W_一-龥]+')
+
+
+def tokenize(text: str):
+    return token_pattern.findall(text.lower())
+
+
+def tokenize_file(path: str):
+    # Runs in worker processes: (path, mtime_ns, size, {token: [line, ...]})
+    try:
+        stat = os.stat(path)
+        postings: dict[str, list[int]] = {}
+        with open(path, "r", encoding="UTF-8", errors="ignore") as file:
+            for line_number, line in enumerate(file, 1):
+                for token in set(tokenize(line)):
+                    postings.setdefault(token, []).append(line_number)
+    except OSError:
+        return path, 0, 0, None
+    return path, stat.st_mtime_ns, stat.st_size, postings
+
+
+def list_drafts(folder: str):
+    drafts = {}
+    for directory, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            if not file_name.lower().endswith(draft_extensions):
+                continue
+            path = os.path.join(directory, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            drafts[path] = (stat.st_mtime_ns, stat.st_size)
+    return drafts
+
+
+class FileIndex:
+    # An inverted index of the drafts in one folder: token -> files -> lines.
+    # Each folder has its own SQLite file. Connections are opened lazily, so
+    # a FileIndex is used by the thread that first touches it.
+    def __init__(self, folder: str, path: str = ""):
+        self.folder = os.path.abspath(folder)
+        if len(path) == 0:
+            folder_hash = hashlib.sha1(self.folder.encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(index_directory, folder_hash + ".sqlite3")
+        self.path = path
+        self.__connection: sqlite3.Connection | None = None
+
+    def __connect(self):
+        if self.__connection is not None:
+            return self.__connection
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        # Readers keep answering while the indexer writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                               "id INTEGER PRIMARY KEY, "
+                               "path TEXT UNIQUE NOT NULL, "
+                               "mtime_ns INTEGER NOT NULL, "
+                               "size INTEGER NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS postings ("
+                               "token TEXT NOT NULL, "
+                               "file_id INTEGER NOT NULL, "
+                               "lines TEXT NOT NULL, "
+                               "PRIMARY KEY (token, file_id)) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS postings_file_id ON postings (file_id)")
+            # Distinct tokens, small enough to scan for words containing a query
+            connection.execute("CREATE TABLE IF NOT EXISTS tokens ("
+                               "token TEXT PRIMARY KEY, "
+                               "n_files INTEGER NOT NULL) WITHOUT ROWID")
+        self.__connection = connection
+        return connection
+
+    def close(self):
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def n_files(self):
+        return self.__connect().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def changes(self):
+        # Paths that are new or whose mtime or size changed, and paths gone
+        indexed = {path: (mtime_ns, size) for path, mtime_ns, size in
+                   self.__connect().execute("SELECT path, mtime_ns, size FROM files")}
+        on_disk = list_drafts(self.folder)
+        changed = [path for path, stat in on_disk.items() if indexed.get(path) != stat]
+        removed = [path for path in indexed if path not in on_disk]
+        return changed, removed
+
+    def store(self, results: list[tuple]):
+        connection = self.__connect()
+        with connection:
+            for path, mtime_ns, size, postings in results:
+                self.__remove(connection, path)
+                if postings is None:
+                    continue
+                file_id = connection.execute("INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                                             (path, mtime_ns, size)).lastrowid
+                connection.executemany("INSERT INTO postings (token, file_id, lines) VALUES (?, ?, ?)",
+                                       ((token, file_id, ','.join(map(str, lines)))
+                                        for token, lines in postings.items()))
+                connection.executemany("INSERT INTO tokens (token, n_files) VALUES (?, 1) "
+                                       "ON CONFLICT (token) DO UPDATE SET n_files = n_files + 1",
+                                       ((token,) for token in postings))
+
+    def remove(self, paths: list[str]):
+        connection = self.__connect()
+        with connection:
+            for path in paths:
+                self.__remove(connection, path)
+
+    @staticmethod
+    def __remove(connection: sqlite3.Connection, path: str):
+        row = connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            connection.execute("UPDATE tokens SET n_files = n_files - 1 WHERE token IN "
+                               "(SELECT token FROM postings WHERE file_id = ?)", row)
+            connection.execute("DELETE FROM tokens WHERE n_files <= 0")
+            connection.execute("DELETE FROM postings WHERE file_id = ?", row)
+            connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def __matching_tokens(self, token: str, is_first: bool, is_last: bool, whole_words: bool):
+        # A query token may sit at the end of a word when it comes first, at
+        # the start of one when it comes last, and anywhere when it is alone.
+        connection = self.__connect()
+        if whole_words or not (is_first or is_last):
+            return [token]
+        if not is_first:
+            return [t for t, in connection.execute("SELECT token FROM tokens WHERE token >= ? AND token < ?",
+                                                   (token, token + '\U0010ffff'))]
+        tokens = [t for t, in connection.execute("SELECT token FROM tokens WHERE instr(token, ?) > 0", (token,))]
+        if not is_last:
+            tokens = [t for t in tokens if t.endswith(token)]
+        return tokens
+
+    def candidates(self, query: str, whole_words: bool = False):
+        # {path: sorted lines} holding every query token in place, or None if
+        # the index cannot narrow the query down.
+        tokens = tokenize(query)
+        if len(tokens) == 0:
+            return None
+        connection = self.__connect()
+        lines_by_file: dict[int, set[int]] | None = None
+        for i, token in enumerate(tokens):
+            token_lines: dict[int, set[int]] = {}
+            for matching_token in self.__matching_tokens(token, i == 0, i == len(tokens) - 1, whole_words):
+                for file_id, lines in connection.execute("SELECT file_id, lines FROM postings WHERE token = ?",
+                                                         (matching_token,)):
+                    if lines_by_file is not None and file_id not in lines_by_file:
+                        continue
+                    token_lines.setdefault(file_id, set()).update(map(int, lines.split(',')))
+            if lines_by_file is None:
+                lines_by_file = token_lines
+            else:
+                lines_by_file = {file_id: lines & token_lines[file_id]
+                                 for file_id, lines in lines_by_file.items() if file_id in token_lines}
+                lines_by_file = {file_id: lines for file_id, lines in lines_by_file.items() if len(lines) > 0}
+            if len(lines_by_file) == 0:
+                return {}
+
+        paths = dict(connection.execute("SELECT id, path FROM files WHERE id IN (%s)" %
+                                        ','.join('?' * len(lines_by_file)), list(lines_by_file)))
+        return {paths[file_id]: sorted(lines) for file_id, lines in lines_by_file.items()}
+
+    def all_files(self):
+        return {path: None for path, in self.__connect().execute("SELECT path FROM files")}
+
+    def search(self, query: str, flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0),
+               is_regex: bool = False, max_hits: int = 1000):
+        # [(path, line number, line)] in file order; the index picks the
+        # lines, the same expression as in the editor confirms them.
+        regex = valid_query(query, is_regex, flags)
+        whole_words = bool(flags & QTextDocument.FindFlag.FindWholeWords)
+        candidates = None if is_regex else self.candidates(query, whole_words)
+        if candidates is None:
+            candidates = self.all_files()
+
+        hits = []
+        for path in sorted(candidates):
+            lines = candidates[path]
+            try:
+                with open(path, "r", encoding="UTF-8", errors="ignore") as file:
+                    text_lines = file.read().split('\n')
+            except OSError:
+                continue
+            for line_number in lines if lines is not None else range(1, len(text_lines) + 1):
+                if line_number > len(text_lines):
+                    break
+                line = text_lines[line_number - 1]
+                if regex.match(line).hasMatch():
+                    hits.append((path, line_number, line))
+                    if len(hits) >= max_hits:
+                        return hits
+        return hits
+
+
+# noinspection PyUnresolvedReferences
+class FileIndexWorker(QObject):
+    # Enough new files to be worth starting worker processes
+    process_pool_min_files = 32
+    store_batch_files = 64
+
+    progress = pyqtSignal(int, int)
+    # folder, number of indexed files, number of files (re)indexed
+    finished = pyqtSignal(str, int, int)
+    failed = pyqtSignal(str, str)
+    # generation, [(path, line number, line)], milliseconds taken
+    searched = pyqtSignal(int, list, float)
+    # generation, message
+    search_failed = pyqtSignal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        # Written by the GUI thread to stop early, e.g. when quitting
+        self.cancelled = False
+        # Written by the GUI thread, searches queued before the latest one are
+        # skipped
+        self.latest_generation = 0
+
+    def update(self, folder: str):
+        self.cancelled = False
+        try:
+            with FileIndex(folder) as index:
+                changed, removed = index.changes()
+                index.remove(removed)
+                if len(changed) >= self.process_pool_min_files:
+                    self.__tokenize_in_processes(index, changed)
+                else:
+                    for i, path in enumerate(changed):
+                        if self.cancelled:
+                            break
+                        index.store([tokenize_file(path)])
+                        self.progress.emit(i + 1, len(changed))
+                self.finished.emit(folder, index.n_files(), len(changed) + len(removed))
+        except (OSError, sqlite3.Error) as e:
+            self.failed.emit(folder, str(e))
+
+    def __tokenize_in_processes(self, index: FileIndex, paths: list[str]):
+        results = []
+        # Forking from this thread could copy locks held by the Qt threads
+        # into the children, so they start from a fresh interpreter
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+            for i, result in enumerate(pool.map(tokenize_file, paths, chunksize=8)):
+                results.append(result)
+                if len(results) == self.store_batch_files:
+                    index.store(results)
+                    results = []
+                self.progress.emit(i + 1, len(paths))
+                if self.cancelled:
+                    pool.shutdown(cancel_futures=True)
+                    break
+        index.store(results)
+
+    def search(self, generation: int, folder: str, query: str, flags: QTextDocument.FindFlag, is_regex: bool,
+               max_hits: int):
+        # Queued after any update of the folder, so the index has caught up
+        if generation != self.latest_generation:
+            return
+        start_time = time.perf_counter()
+        try:
+            with FileIndex(folder) as index:
+                hits = index.search(query, flags, is_regex, max_hits)
+        except InvalidPatternError as e:
+            self.search_failed.emit(generation, str(e))
+            return
+        except (OSError, sqlite3.Error) as e:
+            self.search_failed.emit(generation, f"Cannot read the index: {e}")
+            return
+        self.searched.emit(generation, hits, (time.perf_counter() - start_time) * 1000)
+
+
+# noinspection PyUnresolvedReferences
+class FindInFilesDialog(FindDialog):
+    max_hits = 1000
+
+    # path, line number
+    open_requested = pyqtSignal(str, int)
+    __update_requested = pyqtSignal(str)
+    __search_requested = pyqtSignal(int, str, str, QTextDocument.FindFlag, bool, int)
+
+    def __init__(self, search_editor: QPlainTextEdit, parent=None):
+        super().__init__(search_editor, parent)
+        self.setWindowTitle("Find in Files")
+        self.setWindowIcon(QtGui.QIcon("assets/icons/folder.svg"))
+
+        # Options that only make sense inside the editor
+        for widget in (self.fromStartCheckBox, self.highlightCheckBox, self.incrementalCheckBox,
+                       self.backwardCheckBox, self.searchSelectionCheckBox):
+            widget.hide()
+
+        self.folderLabel = QLabel("F&older: ")
+        self.folderEdit = QLineEdit()
+        self.folderLabel.setBuddy(self.folderEdit)
+        self.browseButton = QPushButton("&Browse...")
+        self.browseButton.setAutoDefault(False)
+        self.browseButton.clicked.connect(self.browse_folder)
+
+        self.resultList = QListWidget()
+        self.resultList.setMinimumSize(560, 280)
+        self.resultList.itemActivated.connect(self.__open_result)
+        self.indexLabel = QLabel()
+
+        folder_layout = QHBoxLayout()
+        folder_layout.addWidget(self.folderLabel)
+        folder_layout.addWidget(self.folderEdit)
+        folder_layout.addWidget(self.browseButton)
+
+        main_layout: QtWidgets.QGridLayout = self.layout()
+        main_layout.addLayout(folder_layout, 2, 0, 1, 2)
+        main_layout.addWidget(self.resultList, 3, 0, 1, 2)
+        main_layout.addWidget(self.indexLabel, 4, 0, 1, 2)
+
+        # The folder being indexed, and the search whose hits are awaited
+        self.__indexing_folder = ""
+        self.__search_generation = 0
+        self.__search_folder = ""
+
+        # Create thread: QThread, worker: QObject
+        self.__index_thread = QThread(self)
+        self.__index_worker = FileIndexWorker()
+        self.__index_worker.moveToThread(self.__index_thread)
+        self.__update_requested.connect(self.__index_worker.update)
+        self.__index_worker.progress.connect(self.__index_progress)
+        self.__index_worker.finished.connect(self.__index_finished)
+        self.__index_worker.failed.connect(self.__index_failed)
+        self.__search_requested.connect(self.__index_worker.search)
+        self.__index_worker.searched.connect(self.__show_hits)
+        self.__index_worker.search_failed.connect(self.__search_failed)
+        QApplication.instance().aboutToQuit.connect(self.__stop_index_thread)
+        # The dialog may go before the application does. Its own slots are
+        # gone by then, so this one only holds what it stops.
+        self.destroyed.connect(functools.partial(self.__stop_thread, self.__index_thread, self.__index_worker))
+        self.__index_thread.start()
+
+    def set_folder(self, folder: str):
+        if len(self.folderEdit.text()) == 0:
+            self.folderEdit.setText(folder)
+
+    def browse_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Folder", self.folderEdit.text())
+        if folder != "":
+            self.folderEdit.setText(folder)
+
+    def __folder(self):
+        folder = self.folderEdit.text().strip()
+        return os.path.abspath(folder) if len(folder) > 0 else ""
+
+    def find(self):
+        folder = self.__folder()
+        if len(folder) == 0 or not os.path.isdir(folder):
+            self.indexLabel.setText("Please choose a folder of drafts.")
+            return
+
+        # Catch up with edits on disk in the background, the search runs on
+        # the same thread once the index is up to date
+        self.__request_update(folder)
+        self.__search(folder)
+
+    def __request_update(self, folder: str):
+        if self.__indexing_folder == folder:
+            return
+        self.__indexing_folder = folder
+        self.indexLabel.setText("Indexing...")
+        self.__update_requested.emit(folder)
+
+    def __search(self, folder: str):
+        self.__search_generation += 1
+        self.__index_worker.latest_generation = self.__search_generation
+        self.matchLabel.clear()
+        self.resultList.clear()
+        query = self.lineEdit.text()
+        if len(query) == 0:
+            return
+
+        flags = search_flags(self.caseCheckBox.isChecked(), self.wholeWordsCheckBox.isChecked())
+        try:
+            valid_query(query, self.regexCheckBox.isChecked(), flags)
+        except InvalidPatternError as e:
+            self.matchLabel.setText(str(e))
+            return
+        self.matchLabel.setText("Searching...")
+        self.__search_folder = folder
+        self.__search_requested.emit(self.__search_generation, folder, query, flags,
+                                     self.regexCheckBox.isChecked(), self.max_hits)
+
+    def __show_hits(self, generation: int, hits: list[tuple[str, int, str]], elapsed_ms: float):
+        if generation != self.__search_generation:
+            return
+        folder = self.__search_folder
+        for path, line_number, line in hits:
+            item = QListWidgetItem(f"{os.path.relpath(path, folder)}:{line_number}: {line.strip()}")
+            item.setData(Qt.ItemDataRole.UserRole, (path, line_number))
+            self.resultList.addItem(item)
+        n_files = len({path for path, _, _ in hits})
+        more = "+" if len(hits) >= self.max_hits else ""
+        self.matchLabel.setText(f"{len(hits)}{more} hits in {n_files} files ({elapsed_ms:.0f} ms)")
+
+    def __search_failed(self, generation: int, message: str):
+        if generation == self.__search_generation:
+            self.matchLabel.setText(message)
+
+    def __open_result(self, item: QListWidgetItem):
+        path, line_number = item.data(Qt.ItemDataRole.UserRole)
+        self.open_requested.emit(path, line_number)
+
+    def __index_progress(self, n_done: int, n_total: int):
+        self.indexLabel.setText(f"Indexing... {n_done}/{n_total} files")
+
+    def __index_finished(self, folder: str, n_files: int, n_updated: int):
+        self.__indexing_folder = ""
+        self.indexLabel.setText(f"{n_files} files indexed.")
+
+    def __index_failed(self, folder: str, message: str):
+        self.__indexing_folder = ""
+        self.indexLabel.setText(f"Cannot index {folder}: {message}")
+
+    def __stop_index_thread(self):
+        self.__stop_thread(self.__index_thread, self.__index_worker)
+
+    @staticmethod
+    def __stop_thread(index_thread: QThread, index_worker: FileIndexWorker):
+        index_worker.cancelled = True
+        index_worker.latest_generation = -1
+        index_thread.quit()
+        index_thread.wait()
+
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication([])
+    editor = QPlainTextEdit()
+    editor.show()
+    find_in_files = FindInFilesDialog(editor)
+    find_in_files.open_requested.connect(lambda path, line: print(path, line))
+    find_in_files.show()
+    app.exec()
@@ -0,0 +1,119 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QRect, QSize, Qt
+from PyQt6.QtGui import QGuiApplication, QIcon, QImage, QPainter, QPixmap
+import hashlib
+import math
+import os
+
+icon_directory = "assets/icons"
+cache_directory = "assets/icon_cache"
+# Bump to throw away atlases rendered by an older layout
+atlas_version = 1
+
+
+def icon_path(name: str, directory: str = icon_directory):
+    return os.path.join(directory, name + ".svg")
+
+
+def atlas_key(names: list[str], size: int, directory: str = icon_directory):
+    # Hashes the SVG bytes, so any edited icon renders a new atlas
+    digest = hashlib.sha1(f"{atlas_version}:{size}".encode("utf-8"))
+    for name in names:
+        digest.update(name.encode("utf-8") + b'\0')
+        with open(icon_path(name, directory), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def cell_size(size: int, device_pixel_ratio: float):
+    return math.ceil(size * device_pixel_ratio)
+
+
+def render_atlas(names: list[str], size: int, device_pixel_ratio: float, directory: str = icon_directory):
+    # One row of square cells, each painted by QIcon as a toolbar would
+    cell = cell_size(size, device_pixel_ratio)
+    atlas = QImage(cell * len(names), cell, QImage.Format.Format_ARGB32_Premultiplied)
+    atlas.fill(Qt.GlobalColor.transparent)
+    for i, name in enumerate(names):
+        image = QImage(cell, cell, QImage.Format.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(device_pixel_ratio)
+        image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(image)
+        QIcon(icon_path(name, directory)).paint(painter, QRect(0, 0, size, size))
+        painter.end()
+
+        image.setDevicePixelRatio(1.0)
+        painter = QPainter(atlas)
+        painter.drawImage(i * cell, 0, image)
+        painter.end()
+    return atlas
+
+
+def save_atlas(atlas: QImage, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp.png"
+    if not atlas.save(temp_path, "PNG"):
+        raise OSError(f"Cannot write {temp_path}")
+    os.replace(temp_path, path)
+
+
+def remove_stale_atlases(atlas_name: str, suffix: str, current_path: str):
+    try:
+        file_names = os.listdir(cache_directory)
+    except OSError:
+        return
+    for file_name in file_names:
+        path = os.path.join(cache_directory, file_name)
+        if file_name.startswith(atlas_name + '-') and file_name.endswith(suffix) and \
+                os.path.normpath(path) != os.path.normpath(current_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def load_icons(names: list[str], size: int, atlas_name: str = "toolbar", directory: str = icon_directory):
+    # {name: QIcon} cut from one pre-rendered atlas per device pixel ratio of
+    # the screens. Only a missing or outdated atlas parses the SVG files.
+    try:
+        key = atlas_key(names, size, directory)
+    except OSError:
+        return {name: QIcon(icon_path(name, directory)) for name in names}
+
+    icons = {name: QIcon() for name in names}
+    device_pixel_ratios = sorted({screen.devicePixelRatio() for screen in QGuiApplication.screens()} or {1.0})
+    for device_pixel_ratio in device_pixel_ratios:
+        cell = cell_size(size, device_pixel_ratio)
+        suffix = f"@{device_pixel_ratio:g}x.png"
+        path = os.path.join(cache_directory, f"{atlas_name}-{key}{suffix}")
+        atlas = QImage(path)
+        if atlas.size() != QSize(cell * len(names), cell):
+            atlas = render_atlas(names, size, device_pixel_ratio, directory)
+            try:
+                save_atlas(atlas, path)
+            except OSError:
+                pass
+            remove_stale_atlases(atlas_name, suffix, path)
+
+        for i, name in enumerate(names):
+            pixmap = QPixmap.fromImage(atlas.copy(QRect(i * cell, 0, cell, cell)))
+            pixmap.setDevicePixelRatio(device_pixel_ratio)
+            icons[name].addPixmap(pixmap)
+    return icons
@@ -0,0 +1,183 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QEvent, QObject, QTimer, Qt
+from PyQt6.QtWidgets import QApplication, QLabel, QPlainTextEdit
+import bisect
+import collections
+import json
+import math
+import os
+import sys
+import time
+
+# EASYTYPING_INSTRUMENT=1 or --instrument times the handlers of every
+# keystroke and shows an overlay on the editor; any other value of the
+# variable is a JSON file the samples are written to on quit.
+instrument_variable = "EASYTYPING_INSTRUMENT"
+instrument_flag = "--instrument"
+
+# Upper bounds of the histogram buckets, in ms
+histogram_bounds_ms = [0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, math.inf]
+
+keystroke_to_paint = "keystroke to paint"
+
+
+class HandlerStats:
+    # The latest samples of one handler in a ring buffer, and the totals
+    def __init__(self, ring_size: int):
+        self.samples_ms: collections.deque[float] = collections.deque(maxlen=ring_size)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, sample_ms: float):
+        self.samples_ms.append(sample_ms)
+        self.count += 1
+        self.total_ms += sample_ms
+
+    def percentile(self, q: float):
+        if len(self.samples_ms) == 0:
+            return 0.0
+        ordered = sorted(self.samples_ms)
+        return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+    def histogram(self):
+        counts = [0] * len(histogram_bounds_ms)
+        for sample_ms in self.samples_ms:
+            counts[bisect.bisect_left(histogram_bounds_ms, sample_ms)] += 1
+        return counts
+
+    def to_dict(self):
+        return {"count": self.count,
+                "total_ms": self.total_ms,
+                "p50_ms": self.percentile(50),
+                "p99_ms": self.percentile(99),
+                "max_ms": max(self.samples_ms, default=0.0),
+                "histogram": self.histogram(),
+                "samples_ms": list(self.samples_ms)}
+
+
+class Instrumentation(QObject):
+    ring_size = 4096
+    overlay_interval_ms = 500
+
+    def __init__(self):
+        super().__init__()
+        setting = os.environ.get(instrument_variable, "")
+        self.enabled = len(setting) > 0 or instrument_flag in sys.argv
+        self.output_path = setting if setting not in ("", "1") else ""
+        self.stats: dict[str, HandlerStats] = {}
+
+        # Key presses not painted yet
+        self.__key_times: list[float] = []
+        self.__editor: QPlainTextEdit | None = None
+        self.__overlay: QLabel | None = None
+        self.__overlay_timer: QTimer | None = None
+        self.__n_shown = -1
+
+    def connect(self, signal, slot, name: str):
+        # Times every call of the slot, or connects it as it is when off
+        if not self.enabled:
+            signal.connect(slot)
+            return
+
+        def timed_slot(*args):
+            start_time = time.perf_counter()
+            try:
+                slot(*args)
+            finally:
+                self.record(name, (time.perf_counter() - start_time) * 1000)
+
+        signal.connect(timed_slot)
+
+    def record(self, name: str, sample_ms: float):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = HandlerStats(self.ring_size)
+        stats.add(sample_ms)
+
+    def watch_editor(self, editor: QPlainTextEdit):
+        # Measures from each key press to the end of the paint showing it
+        if not self.enabled or self.__editor is not None:
+            return
+        self.__editor = editor
+        editor.installEventFilter(self)
+        editor.painted.connect(self.__editor_painted)
+
+        self.__overlay = QLabel(editor.viewport())
+        self.__overlay.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.__overlay.setStyleSheet("QLabel { background: rgba(255, 255, 224, 200); color: black; "
+                                     "font: 9pt monospace; padding: 4px; }")
+        self.__overlay_timer = QTimer(self)
+        self.__overlay_timer.timeout.connect(self.__update_overlay)
+        self.__overlay_timer.start(self.overlay_interval_ms)
+        self.__update_overlay()
+
+        if len(self.output_path) > 0:
+            QApplication.instance().aboutToQuit.connect(lambda: self.dump(self.output_path))
+
+    def eventFilter(self, watched: QObject, event: QEvent):
+        if event.type() == QEvent.Type.KeyPress:
+            self.__key_times.append(time.perf_counter())
+        return False
+
+    def __editor_painted(self):
+        if len(self.__key_times) == 0:
+            return
+        now = time.perf_counter()
+        for key_time in self.__key_times:
+            self.record(keystroke_to_paint, (now - key_time) * 1000)
+        self.__key_times.clear()
+
+    def __update_overlay(self):
+        n_samples = sum(stats.count for stats in self.stats.values())
+        if n_samples == self.__n_shown:
+            return
+        self.__n_shown = n_samples
+
+        lines = []
+        latency = self.stats.get(keystroke_to_paint)
+        if latency is not None:
+            lines.append(f"key to paint  p50 {latency.percentile(50):6.2f}  p99 {latency.percentile(99):6.2f} ms")
+        # The handlers costing the most at the tail
+        handlers = sorted((stats.percentile(99), name) for name, stats in self.stats.items()
+                          if name != keystroke_to_paint)
+        for p99_ms, name in reversed(handlers[-4:]):
+            lines.append(f"{name:<13} p50 {self.stats[name].percentile(50):6.2f}  p99 {p99_ms:6.2f} ms")
+        if len(lines) == 0:
+            lines.append("Waiting for keystrokes...")
+
+        self.__overlay.setText("\n".join(lines))
+        self.__overlay.adjustSize()
+        viewport = self.__editor.viewport()
+        self.__overlay.move(viewport.width() - self.__overlay.width() - 8, 8)
+        self.__overlay.show()
+
+    def to_dict(self):
+        return {"histogram_bounds_ms": [bound if math.isfinite(bound) else None for bound in histogram_bounds_ms],
+                "handlers": {name: stats.to_dict() for name, stats in self.stats.items()}}
+
+    def dump(self, path: str):
+        try:
+            with open(path, "w", encoding="UTF-8") as file:
+                json.dump(self.to_dict(), file, indent=1)
+        except OSError as e:
+            print(f"Cannot write the instrumentation data: {e}", file=sys.stderr)
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,352 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QTextCursor, QTextDocument
+from PyQt6.QtWidgets import QApplication
+from LibInstrumentation import instrumentation
+import functools
+import json
+import os
+import time
+
+# The journal directory holds three files:
+#   snapshot.json  {"seq", "file_name", "text"} or {"seq", "file_name", "file_size", "file_mtime_ns"}
+#                  The base text, either inline or the unchanged file it was opened from.
+#   journal.jsonl  One [seq, position, n_removed, inserted_text] edit per line.
+#                  Positions count UTF-16 code units like QTextDocument does.
+#   state.json     {"file_name", "clean_seq"}: the last edit that has been saved.
+snapshot_name = "snapshot.json"
+journal_name = "journal.jsonl"
+state_name = "state.json"
+
+# EASYTYPING_JOURNAL_DIRECTORY moves the journal, e.g. away from the real
+# one while benchmarking
+directory_variable = "EASYTYPING_JOURNAL_DIRECTORY"
+default_directory = "assets/journal"
+
+
+def journal_directory():
+    return os.environ.get(directory_variable, "") or default_directory
+
+
+def write_json_atomic(path: str, data: dict):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="UTF-8") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_json(path: str):
+    try:
+        with open(path, "r", encoding="UTF-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def utf16(text: str):
+    # Edits may split a surrogate pair, the halves are kept as they are
+    return text.encode("utf-16-le", "surrogatepass")
+
+
+def apply_edits(text: str, edits: list[list]):
+    # Work on UTF-16 code units so positions match the editor's
+    buffer = bytearray(utf16(text))
+    for _, position, n_removed, inserted in edits:
+        buffer[position * 2:(position + n_removed) * 2] = utf16(inserted)
+    return buffer.decode("utf-16-le", "surrogatepass")
+
+
+def recover(directory: str = default_directory):
+    # Returns (file name, text) when the journal holds unsaved edits
+    snapshot = read_json(os.path.join(directory, snapshot_name))
+    state = read_json(os.path.join(directory, state_name))
+    if snapshot is None or state is None:
+        return None
+
+    if "text" in snapshot:
+        text = snapshot["text"]
+    else:
+        try:
+            stat = os.stat(snapshot["file_name"])
+            if (stat.st_size, stat.st_mtime_ns) != (snapshot["file_size"], snapshot["file_mtime_ns"]):
+                return None
+            with open(snapshot["file_name"], "r", encoding=snapshot.get("encoding", "UTF-8"),
+                      errors="ignore") as file:
+                text = file.read()
+        except (OSError, KeyError):
+            return None
+
+    edits = []
+    try:
+        with open(os.path.join(directory, journal_name), "r", encoding="UTF-8") as file:
+            for line in file:
+                try:
+                    edit = json.loads(line)
+                except ValueError:
+                    # A batch cut short by a crash ends the journal
+                    break
+                if edit[0] > snapshot["seq"]:
+                    edits.append(edit)
+    except OSError:
+        pass
+
+    last_seq = edits[-1][0] if len(edits) > 0 else snapshot["seq"]
+    if last_seq <= state.get("clean_seq", 0):
+        return None
+    return state.get("file_name", snapshot["file_name"]), apply_edits(text, edits)
+
+
+# noinspection PyUnresolvedReferences
+class JournalWriter(QObject):
+    def __init__(self, directory: str):
+        super().__init__()
+        self.__directory = directory
+
+    def __path(self, name: str):
+        return os.path.join(self.__directory, name)
+
+    def append_edits(self, lines: str):
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(self.__path(journal_name), "a", encoding="UTF-8") as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+        except OSError:
+            pass
+
+    def write_snapshot(self, snapshot: dict, state: dict):
+        # All edits up to snapshot["seq"] were queued before, so the journal
+        # can be emptied once the snapshot is in place.
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            if "text" not in snapshot:
+                stat = os.stat(snapshot["file_name"])
+                snapshot["file_size"] = stat.st_size
+                snapshot["file_mtime_ns"] = stat.st_mtime_ns
+            write_json_atomic(self.__path(snapshot_name), snapshot)
+            write_json_atomic(self.__path(state_name), state)
+            open(self.__path(journal_name), "w").close()
+        except OSError:
+            pass
+
+    def write_state(self, state: dict):
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            write_json_atomic(self.__path(state_name), state)
+        except OSError:
+            pass
+
+    def stop(self):
+        # Everything queued before this call has been written
+        QThread.currentThread().quit()
+
+    def clear(self):
+        for name in (snapshot_name, journal_name, state_name):
+            try:
+                os.remove(self.__path(name))
+            except OSError:
+                pass
+
+
+# noinspection PyUnresolvedReferences
+class EditJournal(QObject):
+    flush_interval_ms = 2000
+    max_batch_edits = 500
+    compact_min_bytes = 1024 * 1024
+
+    __append_requested = pyqtSignal(str)
+    __snapshot_requested = pyqtSignal(dict, dict)
+    __state_requested = pyqtSignal(dict)
+    __clear_requested = pyqtSignal()
+
+    def __init__(self, document: QTextDocument, directory: str = default_directory, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.__document = document
+        self.__file_name = "untitled.md"
+        self.__suspended = False
+
+        # Sequence numbers keep growing across sessions, so edits left over from
+        # an earlier run are never replayed onto a newer snapshot.
+        self.__seq = time.time_ns()
+        self.__clean_seq = self.__seq
+        self.__file_backed = False
+        self.__length = self.__document_length()
+        self.__edits: list[list] = []
+        self.__journal_bytes = 0
+
+        self.__flush_timer = QTimer(self)
+        self.__flush_timer.setSingleShot(True)
+        self.__flush_timer.setInterval(self.flush_interval_ms)
+        self.__flush_timer.timeout.connect(self.flush)
+
+        # Create thread: QThread, worker: QObject
+        self.__writer_thread = QThread(self)
+        self.__writer = JournalWriter(directory)
+        self.__writer.moveToThread(self.__writer_thread)
+        self.__append_requested.connect(self.__writer.append_edits)
+        self.__snapshot_requested.connect(self.__writer.write_snapshot)
+        self.__state_requested.connect(self.__writer.write_state)
+        self.__clear_requested.connect(self.__writer.clear)
+        QApplication.instance().aboutToQuit.connect(self.__stop_writer_thread)
+        # The journal may go before the application does. Its own slots are
+        # gone by then, so this one only holds what it stops and writes.
+        self.destroyed.connect(functools.partial(self.__stop_thread, self.__writer_thread, self.__writer,
+                                                 self.__edits))
+        self.__writer_thread.start()
+
+        instrumentation.connect(self.__document.contentsChange, self.__contents_changed, "journal")
+
+    def sequence(self):
+        return self.__seq
+
+    def is_clean(self):
+        return self.__clean_seq == self.__seq
+
+    def suspend(self):
+        # Ignore edits, e.g. while a file streams in
+        self.__suspended = True
+
+    def resume(self):
+        # Only valid if the document did not change while suspended
+        self.__suspended = False
+
+    def reset_to_text(self, file_name: str, saved: bool):
+        self.__suspended = False
+        self.__file_name = file_name
+        self.__file_backed = False
+        self.__reset({"text": self.__document.toPlainText()}, saved)
+
+    def reset_to_file(self, file_name: str, encoding: str):
+        # The opened file itself is the base, nothing has to be copied
+        self.__suspended = False
+        self.__file_name = file_name
+        self.__file_backed = True
+        self.__reset({"encoding": encoding}, True)
+
+    def mark_saved(self, file_name: str, seq: int):
+        self.__file_name = file_name
+        self.__clean_seq = max(self.__clean_seq, seq)
+        if self.__file_backed:
+            # The base file has just been overwritten
+            self.reset_to_text(file_name, self.is_clean())
+        else:
+            self.__state_requested.emit(self.__state())
+
+    def discard(self):
+        # Nothing left to recover, e.g. after a clean exit
+        self.__edits.clear()
+        self.__flush_timer.stop()
+        self.__clear_requested.emit()
+
+    def flush(self):
+        self.__flush_timer.stop()
+        if len(self.__edits) == 0:
+            return
+        lines = self.__edit_lines(self.__edits)
+        self.__edits.clear()
+        self.__journal_bytes += len(lines)
+        self.__append_requested.emit(lines)
+
+        # Fold the journal into a snapshot once it outgrows the document, so
+        # the snapshot writes stay proportional to the journal writes.
+        if self.__journal_bytes > max(self.compact_min_bytes, 2 * self.__length) and \
+                not self.__suspended:
+            self.reset_to_text(self.__file_name, self.is_clean())
+
+    def __state(self):
+        return {"file_name": self.__file_name, "clean_seq": self.__clean_seq}
+
+    def __reset(self, snapshot: dict, saved: bool):
+        self.__edits.clear()
+        self.__flush_timer.stop()
+        self.__length = self.__document_length()
+        self.__journal_bytes = 0
+        if saved:
+            self.__clean_seq = self.__seq
+        snapshot.update({"seq": self.__seq, "file_name": self.__file_name})
+        self.__snapshot_requested.emit(snapshot, self.__state())
+
+    def __document_length(self):
+        return self.__document.characterCount() - 1
+
+    def __contents_changed(self, position: int, removed: int, added: int):
+        if self.__suspended:
+            return
+
+        # Reported ranges may include the final paragraph separator
+        new_length = self.__document_length()
+        removed = min(position + removed, self.__length) - position
+        added = min(position + added, new_length) - position
+        if removed < 0 or added < 0 or self.__length - removed + added != new_length:
+            position, removed, added = 0, self.__length, new_length
+
+        cursor = QTextCursor(self.__document)
+        cursor.setPosition(position)
+        cursor.setPosition(position + added, QTextCursor.MoveMode.KeepAnchor)
+        # Same text as toPlainText() would give for the range
+        inserted = cursor.selectedText().replace('\u2029', '\n').replace('\u00a0', ' ')
+        self.__length = new_length
+        self.__append_edit(position, removed, inserted)
+
+    def __append_edit(self, position: int, removed: int, inserted: str):
+        self.__seq += 1
+        # Merge typing and backspacing at the end of the last pending insert
+        if len(self.__edits) > 0:
+            last = self.__edits[-1]
+            last_end = last[1] + len(utf16(last[3])) // 2
+            if removed == 0 and position == last_end:
+                last[0] = self.__seq
+                last[3] += inserted
+                return
+            if len(inserted) == 0 and removed == 1 and position == last_end - 1 and \
+                    len(last[3]) > 0 and ord(last[3][-1]) < 0x10000:
+                last[0] = self.__seq
+                last[3] = last[3][:-1]
+                return
+
+        self.__edits.append([self.__seq, position, removed, inserted])
+        if len(self.__edits) >= self.max_batch_edits:
+            self.flush()
+        elif not self.__flush_timer.isActive():
+            self.__flush_timer.start()
+
+    @staticmethod
+    def __edit_lines(edits: list[list]):
+        return "".join(json.dumps(edit) + '\n' for edit in edits)
+
+    def __stop_writer_thread(self):
+        self.flush()
+        if self.is_clean():
+            self.discard()
+        self.__stop_thread(self.__writer_thread, self.__writer, self.__edits)
+
+    @staticmethod
+    def __stop_thread(writer_thread: QThread, writer: JournalWriter, edits: list[list]):
+        # The writer stops once it has written everything queued before
+        QTimer.singleShot(0, writer.stop)
+        writer_thread.wait()
+        # Edits left when the journal goes first
+        if len(edits) > 0:
+            writer.append_edits(EditJournal.__edit_lines(edits))
+            edits.clear()
@@ -18,13 +18,15 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from PyQt6 import QtGui, QtCore, QtWidgets
 from PyQt6.QtCore import Qt
+from LibInstrumentation import instrumentation
+import collections
+import math
 import re
+import time
 
 
 class WriteProgressBar(QtWidgets.QWidget):
     height = 8
-    progress = 0.0
-    bar_color = "black"
 
     def __init__(self):
         super().__init__()
@@ -34,28 +36,62 @@ class WriteProgressBar(QtWidgets.QWidget):
             QtWidgets.QSizePolicy.Policy.MinimumExpanding
         )
         self.setContentsMargins(0, 0, 0, 0)
+        # The bar is opaque, Qt does not have to clear it before painting
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+        self.__progress = 0.0
+        self.__bar_color = QtGui.QColor("black")
+        # What the screen shows once pending paints are done
+        self.__shown_width = 0
+        self.__shown_color = self.__bar_color
+
+    @property
+    def progress(self):
+        return self.__progress
+
+    @progress.setter
+    def progress(self, progress: float):
+        self.__progress = progress
+        self.__invalidate()
+
+    @property
+    def bar_color(self):
+        return self.__bar_color.name()
+
+    @bar_color.setter
+    def bar_color(self, color: str):
+        self.__bar_color = QtGui.QColor(color)
+        self.__invalidate()
+
+    def __bar_width(self):
+        return min(self.width(), max(0, int(self.width() * self.__progress)))
+
+    def __invalidate(self):
+        # Repaint only the strip between the old and the new end of the bar,
+        # or the bar itself when its color changed.
+        width = self.__bar_width()
+        if self.__bar_color != self.__shown_color:
+            self.update(0, 0, max(width, self.__shown_width), self.height)
+        elif width != self.__shown_width:
+            self.update(min(width, self.__shown_width), 0, abs(width - self.__shown_width), self.height)
+        self.__shown_width = width
+        self.__shown_color = self.__bar_color
 
     def sizeHint(self):
         return QtCore.QSize(self.width(), self.height)
 
+    def resizeEvent(self, a0: QtGui.QResizeEvent):
+        # Qt repaints the whole bar after a resize
+        self.__shown_width = self.__bar_width()
+        super().resizeEvent(a0)
+
     def paintEvent(self, a0):
         painter = QtGui.QPainter(self)
-        brush = QtGui.QBrush()
-
-        brush.setColor(QtGui.QColor("white"))
-        brush.setStyle(Qt.BrushStyle.SolidPattern)
-
-        background_rect = a0.rect()
-        painter.fillRect(background_rect, brush)
-
-        (bar_x0, bar_y0, _, _) = background_rect.getRect()
-        bar_width = int(background_rect.width() *
-                        self.progress)
-        bar_rect = QtCore.QRect(bar_x0, bar_y0,
-                                bar_width, self.height)
 
-        brush.setColor(QtGui.QColor(self.bar_color))
-        painter.fillRect(bar_rect, brush)
+        bar_rect = QtCore.QRect(0, 0, self.__bar_width(), self.height)
+        dirty_rect = a0.rect()
+        painter.fillRect(dirty_rect, QtGui.QColor("white"))
+        painter.fillRect(dirty_rect.intersected(bar_rect), self.__bar_color)
 
         painter.end()
 
@@ -63,6 +99,8 @@ class WriteProgressBar(QtWidgets.QWidget):
 class MyPlainTextEdit(QtWidgets.QPlainTextEdit):
     focus_lost = QtCore.pyqtSignal()
     focus_got = QtCore.pyqtSignal()
+    # Only emitted while instrumenting, so paints cost nothing extra otherwise
+    painted = QtCore.pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -75,6 +113,87 @@ class MyPlainTextEdit(QtWidgets.QPlainTextEdit):
         self.focus_got.emit()
         return super().focusInEvent(e)
 
+    def paintEvent(self, e: QtGui.QPaintEvent | None) -> None:
+        super().paintEvent(e)
+        if instrumentation.enabled:
+            self.painted.emit()
+
+
+word_pattern = re.compile(r'[A-z|0-9]+|[\u4e00-\u9fa5]')
+
+
+# noinspection PyUnresolvedReferences
+class WordCounter(QtCore.QObject):
+    # Words never span a paragraph separator, so the document total is the
+    # sum of per-block counts and only the blocks touched by an edit need
+    # to be tokenized again.
+    def __init__(self, document: QtGui.QTextDocument, parent=None):
+        super().__init__(parent)
+        self.__document = document
+        self.__block_counts: list[int] = []
+        self.__total = 0
+        self.__suspended = False
+        self.recount()
+        instrumentation.connect(self.__document.contentsChange, self.__contents_changed, "word count")
+
+    @staticmethod
+    def count_text(text: str):
+        return len(word_pattern.findall(text))
+
+    def count(self):
+        return self.__total
+
+    def suspend(self):
+        # Ignore edits, e.g. while a file streams in, until resume()
+        self.__suspended = True
+
+    def resume(self):
+        self.__suspended = False
+        self.recount()
+
+    def recount(self):
+        # Splitting the plain text is much faster than walking the blocks
+        lines = self.__document.toPlainText().split('\n')
+        if len(lines) != self.__document.blockCount():
+            lines = []
+            block = self.__document.begin()
+            while block.isValid():
+                lines.append(block.text())
+                block = block.next()
+        self.__block_counts = [self.count_text(line) for line in lines]
+        self.__total = sum(self.__block_counts)
+
+    def __contents_changed(self, position: int, removed: int, added: int):
+        if self.__suspended:
+            return
+        document = self.__document
+        first_block = document.findBlock(position)
+        last_block = document.findBlock(position + added)
+        if not first_block.isValid():
+            self.recount()
+            return
+        if not last_block.isValid():
+            last_block = document.lastBlock()
+
+        first = first_block.blockNumber()
+        last_new = last_block.blockNumber()
+        last_old = last_new - (document.blockCount() - len(self.__block_counts))
+        if last_old < first - 1 or last_old >= len(self.__block_counts):
+            self.recount()
+            return
+
+        new_counts = []
+        block = first_block
+        while True:
+            new_counts.append(self.count_text(block.text()))
+            if block == last_block:
+                break
+            block = block.next()
+
+        old_counts = self.__block_counts[first:last_old + 1]
+        self.__block_counts[first:last_old + 1] = new_counts
+        self.__total += sum(new_counts) - sum(old_counts)
+
 
 # noinspection PyUnresolvedReferences
 class MainEdit(QtWidgets.QWidget):
@@ -83,9 +202,22 @@ class MainEdit(QtWidgets.QWidget):
     n_goal_words = 150
     n_fail_seconds = 5
     n_warning_seconds = 2
+    fade_step_seconds = 0.1
 
     succeeded = QtCore.pyqtSignal()
     failed = QtCore.pyqtSignal()
+    state_changed = QtCore.pyqtSignal()
+
+    # States
+    idle_state = "idle"
+    typing_state = "typing"
+    warning_state = "warning"
+    failed_state = "failed"
+    succeeded_state = "succeeded"
+
+    # Events
+    typed_event = "typed"
+    deadline_event = "deadline"
 
     def __init__(self):
         super().__init__()
@@ -107,150 +239,243 @@ class MainEdit(QtWidgets.QWidget):
                             Qt.AlignmentFlag.AlignHCenter)
         self.setLayout(layout)
 
+        self.word_counter = WordCounter(self.edit.document(), self)
+        self.__whiteness = -1
+
         self.__init_state_machine()
 
-        self.timer = QtCore.QTimer()
-        self.timer_tick_interval_s = 0.1
-        self.timer.setInterval(int(self.timer_tick_interval_s *
-                                   1000))
-        self.idle_seconds = 0.0
+        # Keystrokes only record the time; one single-shot timer wakes the
+        # state machine at the next deadline (warning, fade step, fail).
+        self.deadline_timer = QtCore.QTimer(self)
+        self.deadline_timer.setSingleShot(True)
+        self.deadline_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.__last_typed = time.monotonic()
+        self.__paused_at: float | None = None
 
         self.connect_slots()
 
     def __init_state_machine(self):
-        self.idle_state = EditorIdleState()
-        self.typing_state = EditorTypingState()
-        self.warning_state = EditorWarningState()
-        self.failed_state = EditorFailedState()
-        self.succeeded_state = EditorSucceededState()
-
+        self.__facts = EditorFacts(self)
+        # Set while the state machine edits the text itself, e.g. on failing
+        self.__dispatching = False
+        # (time, event, source state, target state, word count) of every
+        # transition taken while tracing
+        self.trace: collections.deque | None = None
+
+        never_typed = self.__facts.has_no_words
+        goal_reached = self.__facts.has_reached_goal
+        before_warning = self.__facts.is_before_warning
+        before_fail = self.__facts.is_before_fail
+
+        # (state, event) -> [(guard, actions, target state)]
+        # The first transition whose guard holds is taken; events without an
+        # entry are ignored.
+        self.__transitions = {
+            (self.idle_state, self.typed_event): [
+                (None, (self.__start_typing,), self.typing_state)],
+            (self.typing_state, self.typed_event): [
+                (never_typed, (self.__keep_typing, self.__stop_deadlines), self.idle_state),
+                (goal_reached, (self.__keep_typing, self.__succeed), self.succeeded_state),
+                (None, (self.__keep_typing,), self.typing_state)],
+            (self.typing_state, self.deadline_event): [
+                (before_warning, (self.__schedule_warning,), self.typing_state),
+                (None, (self.__fade,), self.warning_state)],
+            (self.warning_state, self.typed_event): [
+                (None, (self.__recover_from_warning,), self.typing_state)],
+            (self.warning_state, self.deadline_event): [
+                (before_fail, (self.__fade,), self.warning_state),
+                (None, (self.__fail,), self.failed_state)],
+            (self.failed_state, self.typed_event): [
+                (None, (self.__restart,), self.idle_state)],
+            (self.succeeded_state, self.typed_event): [
+                (never_typed, (self.__reset_bar,), self.idle_state),
+                (None, (), self.succeeded_state)],
+        }
+
+        self.__current_state = self.idle_state
+
+    @property
+    def current_state(self):
+        return self.__current_state
+
+    @current_state.setter
+    def current_state(self, state: str):
+        if state == self.__current_state:
+            return
+        self.__current_state = state
+        self.state_changed.emit()
+
+    @property
+    def idle_seconds(self):
+        # Time without typing, not counting while the editor lost focus
+        now = self.__paused_at if self.__paused_at is not None else time.monotonic()
+        return now - self.__last_typed
+
+    def mark_typed(self):
+        self.__last_typed = time.monotonic()
+        if self.__paused_at is not None:
+            self.__paused_at = self.__last_typed
+
+    def schedule(self, idle_seconds: float):
+        # Wake up once the editor has been idle for idle_seconds
+        if self.__paused_at is not None:
+            return
+        delay_ms = max(0, math.ceil((idle_seconds - self.idle_seconds) * 1000))
+        self.deadline_timer.start(delay_ms)
+
+    def stop_challenge(self):
+        # Back to idle without deadlines, e.g. before another text replaces
+        # this one, so that no pending deadline fails the new text
+        self.deadline_timer.stop()
+        self.set_editor_whiteness(0)
         self.current_state = self.idle_state
 
+    def start_trace(self, max_transitions: int = 100000):
+        self.trace = collections.deque(maxlen=max_transitions)
+
+    def stop_trace(self):
+        trace, self.trace = self.trace, None
+        return list(trace) if trace is not None else []
+
     def connect_slots(self):
-        self.edit.textChanged.connect(self.__editor_typed)
+        instrumentation.connect(self.edit.textChanged, self.__editor_typed, "state machine")
         self.edit.focus_lost.connect(self.__pause_timer)
         self.edit.focus_got.connect(self.__resume_timer)
-        self.timer.timeout.connect(self.__timer_tick)
-
-    def disconnect_slots(self):
-        self.edit.textChanged.disconnect(self.__editor_typed)
-        self.timer.timeout.disconnect(self.__timer_tick)
+        instrumentation.connect(self.deadline_timer.timeout, self.__deadline_reached, "deadline")
 
     def count_words(self):
-        text = self.edit.toPlainText()
-        length = len(re.findall(r'[A-z|0-9]+|[\u4e00-\u9fa5]', text))
-        return length
+        return self.word_counter.count()
 
     def update_progress_bar(self):
         self.bar.progress = self.count_words() / self.n_goal_words
-        self.bar.update()
 
     def set_editor_whiteness(self, b: int):
-        self.edit.setStyleSheet(
-            f"""
-                QPlainTextEdit {{
-                    color: rgb({b}, {b}, {b});
-                }}
-            """
-        )
+        # Only the text color changes, a new style sheet would re-polish and
+        # lay out the whole editor on every fade step.
+        if b == self.__whiteness:
+            return
+        self.__whiteness = b
+        palette = self.edit.palette()
+        palette.setColor(QtGui.QPalette.ColorRole.Text, QtGui.QColor(b, b, b))
+        self.edit.setPalette(palette)
+
+    def __dispatch(self, event: str):
+        transitions = self.__transitions.get((self.__current_state, event))
+        if transitions is None or self.__dispatching:
+            return
+        facts = self.__facts
+        facts.update(self.count_words(), self.idle_seconds)
+        for guard, actions, target in transitions:
+            if guard is None or guard():
+                break
+        self.__dispatching = True
+        try:
+            for action in actions:
+                action()
+        finally:
+            self.__dispatching = False
+        if self.trace is not None:
+            self.trace.append((time.monotonic(), event, self.__current_state, target, facts.n_words))
+        self.current_state = target
 
     def __editor_typed(self):
-        self.current_state.text_changed(self)
+        self.__dispatch(self.typed_event)
+
+    def __deadline_reached(self):
+        self.__dispatch(self.deadline_event)
 
-    def __timer_tick(self):
-        self.current_state.timer_ticked(self)
-    
     def __pause_timer(self):
-        if self.timer.isActive():
-            self.timer.stop()
-    
+        if self.__paused_at is None:
+            self.__paused_at = time.monotonic()
+        self.deadline_timer.stop()
+
     def __resume_timer(self):
-        if not self.timer.isActive():
-            self.timer.start()
+        if self.__paused_at is None:
+            return
+        self.__last_typed += time.monotonic() - self.__paused_at
+        self.__paused_at = None
+        # Catch up on the deadline that was due, or arm the next one
+        self.__dispatch(self.deadline_event)
+
+    # Transition actions, they read the facts of the current event
+
+    def __stop_deadlines(self):
+        self.deadline_timer.stop()
+
+    def __schedule_warning(self):
+        self.schedule(self.n_warning_seconds)
+
+    def __reset_bar(self):
+        self.bar.bar_color = "black"
+        self.bar.progress = self.__facts.progress
+
+    def __start_typing(self):
+        self.mark_typed()
+        self.__schedule_warning()
+        self.__reset_bar()
+
+    def __keep_typing(self):
+        self.mark_typed()
+        self.set_editor_whiteness(0)
+        self.bar.progress = self.__facts.progress
+
+    def __recover_from_warning(self):
+        self.mark_typed()
+        self.set_editor_whiteness(0)
+        self.__schedule_warning()
+
+    def __succeed(self):
+        self.deadline_timer.stop()
+        self.bar.bar_color = "Green"
+        self.succeeded.emit()
+
+    def __fade(self):
+        fade_seconds = self.__facts.idle_seconds - self.n_warning_seconds
+        whiteness = int(fade_seconds /
+                        (self.n_fail_seconds - self.n_warning_seconds) *
+                        255)
+        self.set_editor_whiteness(max(0, whiteness))
+        # Fade steps stay on a fixed grid, so late wake-ups do not drift
+        next_step = self.n_warning_seconds + \
+            (math.floor(fade_seconds / self.fade_step_seconds) + 1) * self.fade_step_seconds
+        self.schedule(min(next_step, self.n_fail_seconds))
+
+    def __fail(self):
+        self.deadline_timer.stop()
+        self.set_editor_whiteness(0)
+        self.edit.selectAll()
+        self.edit.cut()
+        self.edit.appendPlainText("Sorry, you haven't typed for a while by now.\n"
+                                  "The written texts are saved into clipboard.\n"
+                                  "You can type anything to restart the challenge.")
+        self.failed.emit()
+
+    def __restart(self):
+        self.edit.clear()
+        self.bar.progress = 0.0
+
+
+class EditorFacts:
+    # What the guards of one event see, gathered once per event
+    def __init__(self, main_edit: MainEdit):
+        self.__main_edit = main_edit
+        self.n_words = 0
+        self.progress = 0.0
+        self.idle_seconds = 0.0
 
+    def update(self, n_words: int, idle_seconds: float):
+        self.n_words = n_words
+        self.progress = n_words / self.__main_edit.n_goal_words
+        self.idle_seconds = idle_seconds
 
-class EditorAbstractState:
-    def __init__(self):
-        ...
-
-    def text_changed(self, main_edit: MainEdit):
-        ...
-
-    def timer_ticked(self, main_edit: MainEdit):
-        ...
-
-
-class EditorIdleState(EditorAbstractState):
-    def text_changed(self, main_edit: MainEdit):
-        main_edit.idle_seconds = 0.0
-        main_edit.timer.start()
-        main_edit.bar.bar_color = "black"
-        main_edit.update_progress_bar()
-        main_edit.current_state = main_edit.typing_state
-
-
-class EditorTypingState(EditorAbstractState):
-    def text_changed(self, main_edit: MainEdit):
-        main_edit.idle_seconds = 0.0
-        main_edit.set_editor_whiteness(0)
-        main_edit.update_progress_bar()
-        if main_edit.count_words() == 0:
-            main_edit.timer.stop()
-            main_edit.current_state = main_edit.idle_state
-        if main_edit.bar.progress >= 1.0:
-            main_edit.timer.stop()
-            main_edit.bar.bar_color = "Green"
-            main_edit.bar.update()
-            main_edit.current_state = main_edit.succeeded_state
-
-    def timer_ticked(self, main_edit: MainEdit):
-        main_edit.idle_seconds += main_edit.timer_tick_interval_s
-        if main_edit.idle_seconds > main_edit.n_warning_seconds:
-            main_edit.current_state = main_edit.warning_state
-
-
-class EditorWarningState(EditorAbstractState):
-    def text_changed(self, main_edit: MainEdit):
-        main_edit.disconnect_slots()
-        main_edit.idle_seconds = 0.0
-        main_edit.set_editor_whiteness(0)
-        main_edit.current_state = main_edit.typing_state
-        main_edit.connect_slots()
-
-    def timer_ticked(self, main_edit: MainEdit):
-        main_edit.idle_seconds += main_edit.timer_tick_interval_s
-        whiteness = int((main_edit.idle_seconds - main_edit.n_warning_seconds) /
-                        (main_edit.n_fail_seconds - main_edit.n_warning_seconds) *
-                        255)
-        main_edit.set_editor_whiteness(whiteness)
-        if main_edit.idle_seconds > main_edit.n_fail_seconds:
-            main_edit.disconnect_slots()
-            main_edit.timer.stop()
-            main_edit.set_editor_whiteness(0)
-            main_edit.edit.selectAll()
-            main_edit.edit.cut()
-            main_edit.edit.appendPlainText("Sorry, you haven't typed for a while by now.\n"
-                                           "The written texts are saved into clipboard.\n"
-                                           "You can type anything to restart the challenge.")
-            main_edit.current_state = main_edit.failed_state
-            main_edit.connect_slots()
-
-
-class EditorFailedState(EditorAbstractState):
-    def text_changed(self, main_edit: MainEdit):
-        main_edit.disconnect_slots()
-        main_edit.edit.clear()
-        main_edit.bar.progress = 0.0
-        main_edit.bar.update()
-        main_edit.current_state = main_edit.idle_state
-        main_edit.connect_slots()
-
-
-class EditorSucceededState(EditorAbstractState):
-    def text_changed(self, main_edit: MainEdit):
-        if main_edit.count_words() == 0:
-            main_edit.disconnect_slots()
-            main_edit.bar.bar_color = "black"
-            main_edit.update_progress_bar()
-            main_edit.current_state = main_edit.idle_state
-            main_edit.connect_slots()
+    def has_no_words(self):
+        return self.n_words == 0
+
+    def has_reached_goal(self):
+        return self.progress >= 1.0
+
+    def is_before_warning(self):
+        return self.idle_seconds < self.__main_edit.n_warning_seconds
+
+    def is_before_fail(self):
+        return self.idle_seconds < self.__main_edit.n_fail_seconds
@@ -16,8 +16,64 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from PyQt6 import QtWidgets, QtGui
+from PyQt6 import QtWidgets, QtGui, QtCore
 from PyQt6.QtCore import Qt
+from collections import deque
+import functools
+import re
+import time
+
+
+fence_pattern = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+list_item_pattern = re.compile(r'^ {0,3}([-+*]|\d{1,9}[.)])(\s|$)')
+
+
+def split_markdown_blocks(markdown_txt: str):
+    # Split at blank lines into top-level blocks which render independently.
+    # Fenced code, indented continuations and the items of one list are
+    # kept together so that each block renders the same as in the whole text.
+    blocks = []
+    lines = []
+    fence = None
+    after_blank = False
+    for line in markdown_txt.split('\n'):
+        if fence is not None:
+            lines.append(line)
+            if line.strip().startswith(fence) and len(line.strip().strip(fence[0])) == 0:
+                fence = None
+            continue
+
+        if len(line.strip()) == 0:
+            after_blank = len(lines) > 0
+            lines.append(line)
+            continue
+
+        if after_blank and not line.startswith("    ") and not line.startswith("\t"):
+            continues_list = list_item_pattern.match(line) is not None and \
+                list_item_pattern.match(lines[0]) is not None
+            if not continues_list:
+                blocks.append('\n'.join(lines))
+                lines = []
+        after_blank = False
+
+        fence_match = fence_pattern.match(line)
+        if fence_match is not None:
+            fence = fence_match.group(1)
+        lines.append(line)
+
+    if len(lines) > 0:
+        blocks.append('\n'.join(lines))
+    return blocks
+
+
+def create_preview_document(style_str: str):
+    document = QtGui.QTextDocument()
+    document.setDefaultFont(QtGui.QFont("Arial", 15))
+    option = QtGui.QTextOption()
+    option.setFlags(QtGui.QTextOption.Flag.AddSpaceForLineAndParagraphSeparators)
+    document.setDefaultTextOption(option)
+    document.setDefaultStyleSheet(style_str)
+    return document
 
 
 class MyTextViewNoZoom(QtWidgets.QTextEdit):
@@ -30,7 +86,107 @@ class MyTextViewNoZoom(QtWidgets.QTextEdit):
             super().wheelEvent(e)
 
 
+# noinspection PyUnresolvedReferences
+class PreviewRenderWorker(QtCore.QObject):
+    chunk_blocks = 256
+
+    # generation, first replaced block, end of replaced blocks, documents of the new blocks,
+    # whether the render is complete. The documents go as an object, as a list signal
+    # would drop their wrappers.
+    rendered = QtCore.pyqtSignal(int, int, int, object, bool)
+
+    def __init__(self, style_str: str):
+        super().__init__()
+        # Written by the GUI thread whenever newer text is requested
+        self.latest_generation = 0
+        self.__style_str = style_str
+        self.__blocks: list[str] = []
+
+    def render(self, generation: int, markdown_txt: str):
+        if generation != self.latest_generation:
+            return
+
+        blocks = split_markdown_blocks(markdown_txt)
+        n_prefix = 0
+        n_common = min(len(blocks), len(self.__blocks))
+        while n_prefix < n_common and blocks[n_prefix] == self.__blocks[n_prefix]:
+            n_prefix += 1
+        n_suffix = 0
+        while n_suffix < n_common - n_prefix and \
+                blocks[-1 - n_suffix] == self.__blocks[-1 - n_suffix]:
+            n_suffix += 1
+        old_end = len(self.__blocks) - n_suffix
+        new_end = len(blocks) - n_suffix
+
+        # Long renders go out in chunks, so the preview fills in while the
+        # rest is parsed and only a chunk of documents is held at a time.
+        first = n_prefix
+        documents = []
+        for i in range(n_prefix, new_end):
+            if generation != self.latest_generation:
+                return
+            documents.append(self.__render_document(blocks[i]))
+            if len(documents) == self.chunk_blocks and i + 1 < new_end:
+                self.__emit_chunk(generation, first, old_end, documents, False)
+                # Chunks are applied in the order they are emitted, so the
+                # blocks emitted so far are what the preview document shows.
+                self.__blocks[first:old_end] = blocks[first:i + 1]
+                first = old_end = i + 1
+                documents = []
+
+        self.__emit_chunk(generation, first, old_end, documents, True)
+        self.__blocks = blocks
+
+    def __emit_chunk(self, generation: int, first: int, old_end: int,
+                     documents: list[QtGui.QTextDocument], complete: bool):
+        # Copying a document creates its lists and frames lazily, so the GUI
+        # thread owns the documents from here on and deletes them once copied.
+        gui_thread = QtCore.QCoreApplication.instance().thread()
+        for document in documents:
+            document.moveToThread(gui_thread)
+        self.rendered.emit(generation, first, old_end, documents, complete)
+
+    def __render_document(self, markdown_txt: str):
+        # Apply the style sheet while parsing, then parse the resolved formats
+        document = create_preview_document(self.__style_str)
+        document.setMarkdown(markdown_txt)
+        document.setHtml(document.toHtml())
+
+        # Lead with an empty unformatted block. It merges into the block at
+        # the insertion point, so the rendered blocks keep their own formats.
+        cursor = QtGui.QTextCursor(document)
+        cursor.insertBlock()
+        cursor.movePosition(QtGui.QTextCursor.MoveOperation.Start)
+        cursor.setBlockFormat(QtGui.QTextBlockFormat())
+        cursor.setBlockCharFormat(QtGui.QTextCharFormat())
+        return document
+
+
+class PreviewPatch:
+    # One chunk of a render to apply: blocks [first, old_end) of the preview
+    # become the new blocks, which are inserted a slice at a time
+    def __init__(self, generation: int, first: int, old_end: int,
+                 documents: list[QtGui.QTextDocument], complete: bool):
+        self.generation = generation
+        self.first = first
+        self.old_end = old_end
+        self.documents: list[QtGui.QTextDocument | None] = documents
+        self.complete = complete
+        # Where the next block goes, once the old blocks are removed
+        self.position = -1
+        self.lengths: list[int] = []
+
+
+# noinspection PyUnresolvedReferences
 class PreviewWidget(QtWidgets.QDockWidget):
+    debounce_ms = 120
+    max_delay_ms = 500
+    frame_budget_ms = 16.0
+
+    render_finished = QtCore.pyqtSignal(float)
+    # The text goes as an object, so it is not converted on the way
+    __render_requested = QtCore.pyqtSignal(int, object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -42,24 +198,203 @@ class PreviewWidget(QtWidgets.QDockWidget):
 
         self.preview = MyTextViewNoZoom()
         self.preview.setReadOnly(True)
-        self.__preview_doc = QtGui.QTextDocument()
-
         with open("assets/styles/markdown.css") as file:
-            style_str = "".join(file.readlines())
-        self.__preview_doc.setDefaultFont(QtGui.QFont("Arial", 15))
-        option = QtGui.QTextOption()
-        option.setFlags(QtGui.QTextOption.Flag.AddSpaceForLineAndParagraphSeparators)
-        self.__preview_doc.setDefaultTextOption(option)
-        self.__preview_doc.setDefaultStyleSheet(style_str)
+            self.__style_str = "".join(file.readlines())
+        self.__preview_doc = create_preview_document(self.__style_str)
+        # Owned by the view, so it is never deleted while the view shows it
+        self.__preview_doc.setParent(self.preview)
+        self.__preview_doc.setUndoRedoEnabled(False)
+        self.preview.setDocument(self.__preview_doc)
+
+        # Lengths of the rendered blocks in document order. Every block
+        # starts with its own paragraph separator and follows the empty
+        # first block of the preview document.
+        self.__block_lengths: list[int] = []
+
+        # Renders waiting to be patched in, oldest first
+        self.__patches: deque[PreviewPatch] = deque()
+        self.__patch_timer = QtCore.QTimer(self)
+        self.__patch_timer.setInterval(0)
+        self.__patch_timer.timeout.connect(self.__apply_slice)
+        # Blocks to insert per slice, sized from the speed of the last one,
+        # and what an edit of the preview costs without any new blocks
+        self.__slice_blocks = 16
+        self.__edit_ms = 0.0
+        self.__patch_ms = 0.0
+        self.__longest_slice_ms = 0.0
+
+        self.__source_doc: QtGui.QTextDocument | None = None
+        self.__first_request_time = 0.0
+        self.__render_timer = QtCore.QTimer(self)
+        self.__render_timer.setSingleShot(True)
+        self.__render_timer.setInterval(self.debounce_ms)
+        self.__render_timer.timeout.connect(self.__render_pending)
+
+        self.last_render_ms = 0.0
+        self.last_patch_ms = 0.0
+        self.last_slice_ms = 0.0
+        self.render_count = 0
+        self.over_budget_count = 0
+
+        # Create thread: QThread, worker: QObject
+        self.__generation = 0
+        self.__request_time = 0.0
+        self.__render_thread = QtCore.QThread(self)
+        self.__render_worker = PreviewRenderWorker(self.__style_str)
+        self.__render_worker.moveToThread(self.__render_thread)
+        self.__render_requested.connect(self.__render_worker.render)
+        self.__render_worker.rendered.connect(self.__apply_render)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.__stop_render_thread)
+        # The widget may go before the application does. Its own slots are
+        # gone by then, so this one only holds what it stops. Qt deletes the
+        # thread with the widget, after this stopped it.
+        self.destroyed.connect(functools.partial(self.__stop_thread, self.__render_thread, self.__render_worker))
+        # Parsing waits for idle time, so it never slows down the GUI thread
+        # patching the preview on a busy or single core
+        self.__render_thread.start(QtCore.QThread.Priority.IdlePriority)
 
         self.setWidget(self.preview)
 
         self.update_preview("")
 
+    def request_preview(self, source_doc: QtGui.QTextDocument):
+        # Coalesce bursts of edits, but never hold a render back for longer
+        # than max_delay_ms while the user keeps typing.
+        self.__source_doc = source_doc
+        now = time.perf_counter()
+        if not self.__render_timer.isActive():
+            self.__first_request_time = now
+            self.__render_timer.start()
+        elif (now - self.__first_request_time) * 1000 < self.max_delay_ms:
+            self.__render_timer.start()
+
+    def __render_pending(self):
+        if self.__source_doc is None or self.isHidden():
+            return
+        source_doc = self.__source_doc
+        self.__source_doc = None
+        self.update_preview(source_doc.toPlainText())
+
     def update_preview(self, markdown_txt: str):
-        self.__preview_doc.setMarkdown(markdown_txt)
-        self.__preview_doc.setHtml(self.__preview_doc.toHtml())
-        self.preview.setDocument(self.__preview_doc)
+        # Newer text supersedes renders which are queued or still running
+        self.__generation += 1
+        self.__render_worker.latest_generation = self.__generation
+        self.__request_time = time.perf_counter()
+        self.__render_requested.emit(self.__generation, markdown_txt)
+
+    def __apply_render(self, generation: int, first: int, old_end: int,
+                       documents: list[QtGui.QTextDocument], complete: bool):
+        self.__patches.append(PreviewPatch(generation, first, old_end, documents, complete))
+        if not self.__patch_timer.isActive():
+            self.__patch_timer.start()
+
+    def __apply_slice(self):
+        # Patches go in oldest first, a slice of blocks per turn of the event
+        # loop, so typing and painting go on while a long document fills the
+        # preview. Each slice is one edit block, which lays out its blocks.
+        start_time = time.perf_counter()
+        n_inserted = 0
+        finished = []
+        cursor = QtGui.QTextCursor(self.__preview_doc)
+        cursor.beginEditBlock()
+        while len(self.__patches) > 0:
+            patch = self.__patches[0]
+            n_inserted += self.__apply_patch(cursor, patch, self.__slice_blocks - n_inserted)
+            if len(patch.lengths) < len(patch.documents):
+                break
+            finished.append(self.__patches.popleft())
+        cursor.endEditBlock()
+        if len(self.__patches) == 0:
+            self.__patch_timer.stop()
+        end_time = time.perf_counter()
+
+        slice_ms = (end_time - start_time) * 1000
+        if n_inserted == 1:
+            self.__edit_ms = slice_ms
+        elif n_inserted > 1:
+            # No slice costs less than an edit
+            self.__edit_ms = min(self.__edit_ms, slice_ms)
+        if n_inserted > 0:
+            # Every edit moves the blocks after it, which takes longer the
+            # longer the document is. The new blocks get half a frame on top.
+            block_ms = max(slice_ms - self.__edit_ms, 0.01) / n_inserted
+            fitting = int(self.frame_budget_ms / 2 / block_ms)
+            self.__slice_blocks = max(1, min(2 * self.__slice_blocks, fitting))
+        self.__patch_ms += slice_ms
+        self.__longest_slice_ms = max(self.__longest_slice_ms, slice_ms)
+        if slice_ms > self.frame_budget_ms:
+            self.over_budget_count += 1
+        if any(patch.complete and patch.generation == self.__generation for patch in finished):
+            # GUI time spent since the last finished render
+            self.last_patch_ms = self.__patch_ms
+            self.last_slice_ms = self.__longest_slice_ms
+            self.__patch_ms = 0.0
+            self.__longest_slice_ms = 0.0
+            self.last_render_ms = (end_time - self.__request_time) * 1000
+            self.render_count += 1
+            self.render_finished.emit(self.last_render_ms)
+
+    def __apply_patch(self, cursor: QtGui.QTextCursor, patch: PreviewPatch, n_blocks: int):
+        # Inserts up to n_blocks blocks of the patch, returns how many it did
+        if patch.position < 0:
+            start = sum(self.__block_lengths[:patch.first])
+            end = start + sum(self.__block_lengths[patch.first:patch.old_end])
+            if end > start:
+                cursor.setPosition(start)
+                cursor.setPosition(end, QtGui.QTextCursor.MoveMode.KeepAnchor)
+                self.__remove_keeping_block_format(cursor)
+            patch.position = start
+
+        n_inserted = 0
+        while len(patch.lengths) < len(patch.documents) and n_inserted < n_blocks:
+            i = len(patch.lengths)
+            cursor.setPosition(patch.position)
+            cursor.insertFragment(QtGui.QTextDocumentFragment(patch.documents[i]))
+            # Deleted here, a slice at a time
+            patch.documents[i] = None
+            patch.lengths.append(cursor.position() - patch.position)
+            patch.position = cursor.position()
+            n_inserted += 1
+
+        if len(patch.lengths) == len(patch.documents):
+            # Later patches count blocks from the ones this patch leaves
+            self.__block_lengths[patch.first:patch.old_end] = patch.lengths
+        return n_inserted
+
+    @staticmethod
+    def __remove_keeping_block_format(cursor: QtGui.QTextCursor):
+        # Removing a range that spans blocks leaves the merged block with the
+        # format of the last removed block, so restore the format of the block
+        # the range starts in.
+        block = cursor.document().findBlock(cursor.selectionStart())
+        block_format = block.blockFormat()
+        char_format = block.charFormat()
+        text_list = block.textList()
+
+        cursor.removeSelectedText()
+
+        block = cursor.block()
+        cursor.setBlockFormat(block_format)
+        cursor.setBlockCharFormat(char_format)
+        if block.textList() is not None and block.textList() != text_list:
+            block.textList().remove(block)
+        if text_list is not None and block.textList() is None:
+            text_list.add(block)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.__source_doc is not None:
+            self.__render_timer.start()
+
+    def __stop_render_thread(self):
+        self.__stop_thread(self.__render_thread, self.__render_worker)
+
+    @staticmethod
+    def __stop_thread(render_thread: QtCore.QThread, render_worker: PreviewRenderWorker):
+        # A running render stops at its next block
+        render_worker.latest_generation = -1
+        render_thread.quit()
+        render_thread.wait()
 
     def toggle_show_hide(self):
         if self.isHidden():
@@ -30,14 +30,15 @@ LibReplace.py
 
 """
 
-from PyQt6 import QtGui, QtCore, QtWidgets
-from PyQt6.QtGui import QTextCursor, QTextDocument
+from PyQt6 import QtGui, QtWidgets
+from PyQt6.QtGui import QTextCursor
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import (
     QDialog, QLabel, QLineEdit, QCheckBox, QGridLayout,
     QVBoxLayout, QPlainTextEdit, QPushButton, QDialogButtonBox,
     QHBoxLayout
 )
+from LibSearch import IncrementalSearch, InvalidPatternError, MatchIndex, find_next, replace_all, search_flags
 
 
 # noinspection PyUnresolvedReferences
@@ -62,6 +63,8 @@ class FindReplaceDialog(QDialog):
         self.fromStartCheckBox.setChecked(True)
         self.regexCheckBox = QCheckBox("Regex")
         self.regexCheckBox.setChecked(False)
+        self.incrementalCheckBox = QCheckBox("Search as you &type")
+        self.incrementalCheckBox.setChecked(False)
 
         self.findButton = QPushButton("&Find")
         self.findButton.clicked.connect(self.find)
@@ -90,6 +93,11 @@ class FindReplaceDialog(QDialog):
         self.buttonBox.addButton(self.moreButton, QDialogButtonBox.ButtonRole.ActionRole)
 
         self.regexCheckBox.toggled.connect(self.regex_mode)
+        self.incrementalCheckBox.toggled.connect(self.__incremental_toggled)
+        self.lineEdit.textChanged.connect(self.__query_edited)
+        self.caseCheckBox.toggled.connect(self.__query_edited)
+        self.regexCheckBox.toggled.connect(self.__query_edited)
+        self.wholeWordsCheckBox.toggled.connect(self.__query_edited)
 
         self.moreButton.toggled.connect(self.extension.setVisible)
 
@@ -114,6 +122,15 @@ class FindReplaceDialog(QDialog):
         left_layout.addWidget(self.caseCheckBox)
         left_layout.addWidget(self.regexCheckBox)
         left_layout.addWidget(self.fromStartCheckBox)
+        left_layout.addWidget(self.incrementalCheckBox)
+
+        self.statusLabel = QLabel()
+        left_layout.addWidget(self.statusLabel)
+
+        # Built once searching as you type is first checked, plain finds need
+        # neither the index nor its search thread
+        self.match_index: MatchIndex | None = None
+        self.incremental_search: IncrementalSearch | None = None
 
         main_layout = QGridLayout()
         main_layout.setSizeConstraint(QtWidgets.QLayout.SizeConstraint.SetFixedSize)
@@ -129,8 +146,6 @@ class FindReplaceDialog(QDialog):
         self.extension.hide()
 
     def find(self):
-        query = self.lineEdit.text()
-        re = QtCore.QRegularExpression()
         find_editor = self.replace_editor
 
         if self.fromStartCheckBox.isChecked():
@@ -139,36 +154,56 @@ class FindReplaceDialog(QDialog):
             find_editor.setTextCursor(cursor)
         self.fromStartCheckBox.setChecked(False)
 
-        if self.regexCheckBox.isChecked():
-            re.setPattern(query)
-            if self.backwardCheckBox.isChecked():
-                self.lastMatch = find_editor.find(re, QtGui.QTextDocument.FindFlag.FindBackward)
-            else:
-                self.lastMatch = find_editor.find(re)
-
         if self.searchSelectionCheckBox.isChecked():
-            query = find_editor.textCursor().selectedText()
-            find_editor.find(query)
-
+            # Look for the next occurrence of the selected text
+            self.lastMatch = find_next(find_editor, find_editor.textCursor().selectedText())
+            return
+        if self.match_index is not None and self.match_index.is_active():
+            # The incremental search already has every match
+            self.lastMatch = self.match_index.step(self.backwardCheckBox.isChecked())
+            return
+
+        self.statusLabel.clear()
+        try:
+            self.lastMatch = find_next(find_editor, self.lineEdit.text(), self.regexCheckBox.isChecked(),
+                                       self.__search_flags(self.backwardCheckBox.isChecked()))
+        except InvalidPatternError as e:
+            self.lastMatch = False
+            self.statusLabel.setText(str(e))
+
+    def __search_flags(self, backward: bool = False):
+        return search_flags(self.caseCheckBox.isChecked(), self.wholeWordsCheckBox.isChecked(), backward)
+
+    def __incremental_toggled(self, checked: bool):
+        if checked:
+            if self.incremental_search is None:
+                self.match_index = MatchIndex(self.replace_editor, self)
+                self.match_index.changed.connect(self.__update_match_count)
+                self.incremental_search = IncrementalSearch(self.replace_editor, self.match_index, self)
+                self.incremental_search.failed.connect(self.statusLabel.setText)
+            self.__query_edited()
+            return
+        self.incremental_search.cancel()
+        self.match_index.clear()
+
+    def __query_edited(self):
+        if self.incrementalCheckBox.isChecked():
+            self.incremental_search.search(self.lineEdit.text(), self.__search_flags(),
+                                           self.regexCheckBox.isChecked())
+
+    def __update_match_count(self):
+        if not self.match_index.is_active():
+            return
+        if self.match_index.is_loading():
+            self.statusLabel.setText(f"Searching... {self.match_index.count()} matches")
         else:
-            if self.backwardCheckBox.isChecked():
-                flags = QTextDocument.FindFlag.FindBackward
-                if self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords | QTextDocument.FindFlag.FindCaseSensitively
-                elif self.wholeWordsCheckBox.isChecked() and not self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords
-                elif not self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindCaseSensitively
-            else:
-                flags = QTextDocument.FindFlag(0)
-                if self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords | QTextDocument.FindFlag.FindCaseSensitively
-                elif self.wholeWordsCheckBox.isChecked() and not self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindWholeWords
-                elif not self.wholeWordsCheckBox.isChecked() and self.caseCheckBox.isChecked():
-                    flags |= QTextDocument.FindFlag.FindCaseSensitively
-
-            self.lastMatch = find_editor.find(query, flags)
+            self.statusLabel.setText(f"{self.match_index.count()} matches")
+
+    def hideEvent(self, event: QtGui.QHideEvent):
+        if self.incremental_search is not None:
+            self.incremental_search.cancel()
+            self.match_index.clear()
+        super().hideEvent(event)
 
     def replace(self):
         replace_editor = self.replace_editor
@@ -179,14 +214,21 @@ class FindReplaceDialog(QDialog):
             replace_editor.setTextCursor(cursor)
 
     def replace_all(self):
+        replace_editor = self.replace_editor
         self.lastMatch = False
-        self.find()
-        self.replace()
 
-        replace_editor = self.replace_editor
-        for i in range(replace_editor.document().lineCount()):
-            self.find()
-            self.replace()
+        if self.searchSelectionCheckBox.isChecked():
+            query, is_regex = replace_editor.textCursor().selectedText(), False
+        else:
+            query, is_regex = self.lineEdit.text(), self.regexCheckBox.isChecked()
+        try:
+            n_replaced = replace_all(replace_editor.document(), query, self.replaceField.text(),
+                                     self.__search_flags(), is_regex)
+        except InvalidPatternError as e:
+            self.statusLabel.setText(str(e))
+            return 0
+        self.statusLabel.setText(f"Replaced {n_replaced} occurrence(s).")
+        return n_replaced
 
     def regex_mode(self):
         self.caseCheckBox.setChecked(False)
@@ -0,0 +1,588 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QObject, QPoint, QRect, QRegularExpression, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QColor, QTextBlock, QTextCharFormat, QTextCursor, QTextDocument
+from PyQt6.QtWidgets import QApplication, QPlainTextEdit, QTextEdit
+import bisect
+import functools
+
+
+class InvalidPatternError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=8)
+def search_flags(case_sensitive: bool = False, whole_words: bool = False, backward: bool = False):
+    flags = QTextDocument.FindFlag(0)
+    if case_sensitive:
+        flags |= QTextDocument.FindFlag.FindCaseSensitively
+    if whole_words:
+        flags |= QTextDocument.FindFlag.FindWholeWords
+    if backward:
+        flags |= QTextDocument.FindFlag.FindBackward
+    return flags
+
+
+@functools.lru_cache(maxsize=64)
+def compile_query(query: str, is_regex: bool = False,
+                  flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0)):
+    # The same matching rules as QTextDocument.find, as one expression.
+    # Cached, so repeated searches reuse the compiled pattern.
+    pattern = query if is_regex else QRegularExpression.escape(query)
+    if flags & QTextDocument.FindFlag.FindWholeWords:
+        pattern = r"(?<![\p{L}\p{N}])(?:" + pattern + r")(?![\p{L}\p{N}])"
+    # ^ and $ match at every line, as they do for QTextDocument.find
+    options = QRegularExpression.PatternOption.UseUnicodePropertiesOption | \
+        QRegularExpression.PatternOption.MultilineOption
+    # QTextDocument.find overrides the case option of an expression with
+    # FindCaseSensitively, so regex searches follow the flag as well. The
+    # dialogs clear it in regex mode, which keeps those case insensitive.
+    if not flags & QTextDocument.FindFlag.FindCaseSensitively:
+        options |= QRegularExpression.PatternOption.CaseInsensitiveOption
+    regex = QRegularExpression(pattern, options)
+    # Compile now rather than on first use, and only once
+    regex.optimize()
+    return regex
+
+
+def valid_query(query: str, is_regex: bool = False,
+                flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0)):
+    regex = compile_query(query, is_regex, flags & ~QTextDocument.FindFlag.FindBackward)
+    if not regex.isValid():
+        raise InvalidPatternError(f"Invalid regex: {regex.errorString()}")
+    return regex
+
+
+def find_next(editor: QPlainTextEdit, query: str, is_regex: bool = False,
+              flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0)):
+    # Exactly one search from the cursor, which selects the match
+    if len(query) == 0:
+        return False
+    if is_regex:
+        return editor.find(valid_query(query, True, flags), flags)
+    return editor.find(query, flags)
+
+
+def find_all(document: QTextDocument, query: str,
+             flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0), is_regex: bool = False):
+    # Every match as (start, end), in document order and without overlaps.
+    # The plain text is scanned once; QTextDocument.find would copy the text
+    # of the block again for every match.
+    if len(query) == 0:
+        return []
+    regex = valid_query(query, is_regex, flags)
+
+    # Plain text positions are document positions, but the plain text also
+    # breaks lines inside a block at U+2028
+    text = document.toPlainText()
+    if text.count('\n') + 1 != document.blockCount():
+        return find_in_blocks(regex, document.begin(), document.lastBlock())
+    return list(find_in_lines(regex, text))
+
+
+def find_in_lines(regex: QRegularExpression, text: str):
+    # Matches within each line of text, as (start, end). Like
+    # QTextDocument.find, a match never spans blocks, and one that would is
+    # looked for again inside its block.
+    position = 0
+    for line in text.split('\n'):
+        iterator = regex.globalMatch(line)
+        while iterator.hasNext():
+            match = iterator.next()
+            if match.capturedLength() > 0:
+                yield position + match.capturedStart(), position + match.capturedEnd()
+        # Positions count UTF-16 code units
+        position += (len(line) if line.isascii() else len(line.encode("utf-16-le", "surrogatepass")) // 2) + 1
+
+
+def find_in_blocks(regex: QRegularExpression, first_block: QTextBlock, last_block: QTextBlock):
+    # Matches from first_block to last_block inclusive, as (start, end)
+    matches = []
+    block = first_block
+    while block.isValid() and block.blockNumber() <= last_block.blockNumber():
+        position = block.position()
+        # QTextDocument.find sees no-break spaces as spaces
+        iterator = regex.globalMatch(block.text().replace('\u00a0', ' '))
+        while iterator.hasNext():
+            match = iterator.next()
+            if match.capturedLength() > 0:
+                matches.append((position + match.capturedStart(), position + match.capturedEnd()))
+        block = block.next()
+    return matches
+
+
+def replace_all(document: QTextDocument, query: str, replacement: str,
+                flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0), is_regex: bool = False):
+    matches = find_all(document, query, flags, is_regex)
+    if len(matches) == 0:
+        return 0
+
+    # Rebuild the text between the first and the last match and insert it in
+    # one go: a single undo step and a single change notification. Slicing
+    # is done on UTF-16 code units to stay in document positions.
+    first, last = matches[0][0], matches[-1][1]
+    cursor = QTextCursor(document)
+    cursor.setPosition(first)
+    cursor.setPosition(last, QTextCursor.MoveMode.KeepAnchor)
+    span = cursor.selectedText().encode("utf-16-le", "surrogatepass")
+    replacement = replacement.encode("utf-16-le", "surrogatepass")
+
+    pieces = []
+    position = first
+    for start, end in matches:
+        pieces.append(span[(position - first) * 2:(start - first) * 2])
+        pieces.append(replacement)
+        position = end
+
+    cursor.beginEditBlock()
+    cursor.insertText(b"".join(pieces).decode("utf-16-le", "surrogatepass"))
+    cursor.endEditBlock()
+    return len(matches)
+
+
+# noinspection PyUnresolvedReferences
+class MatchIndex(QObject):
+    # All match positions of one query, kept up to date while the document
+    # is edited. Only the matches inside the viewport are highlighted.
+    max_highlights = 1000
+
+    changed = pyqtSignal()
+
+    def __init__(self, editor: QPlainTextEdit, parent=None):
+        super().__init__(parent)
+        self.__editor = editor
+        self.__document = editor.document()
+        self.__regex: QRegularExpression | None = None
+
+        # Matches before the gap are stored as positions, the ones after it as
+        # position minus document length. Text inserted or removed at the gap
+        # changes neither, so typing in one place never shifts the whole index.
+        self.__starts: list[int] = []
+        self.__ends: list[int] = []
+        self.__gap = 0
+        self.__current = -1
+        self.__length = self.__document.characterCount()
+        # Matches are still streaming in from a background scan
+        self.__loading = False
+
+        self.match_format = QTextCharFormat()
+        self.match_format.setBackground(QColor("yellow"))
+        self.current_format = QTextCharFormat()
+        self.current_format.setBackground(QColor("orange"))
+        # The extra selections this index has put on the editor
+        self.__highlights: list[QTextEdit.ExtraSelection] = []
+
+        self.__highlight_timer = QTimer(self)
+        self.__highlight_timer.setSingleShot(True)
+        self.__highlight_timer.setInterval(0)
+        self.__highlight_timer.timeout.connect(self.__highlight_visible)
+
+        self.__document.contentsChange.connect(self.__contents_changed)
+        self.__editor.updateRequest.connect(self.__update_requested)
+
+    def count(self):
+        return len(self.__starts)
+
+    def current(self):
+        # Index of the selected match, -1 if none
+        return self.__current
+
+    def is_active(self):
+        return self.__regex is not None
+
+    def is_loading(self):
+        return self.__loading
+
+    def match(self, i: int):
+        if i < self.__gap:
+            return self.__starts[i], self.__ends[i]
+        return self.__starts[i] + self.__length, self.__ends[i] + self.__length
+
+    def set_query(self, query: str, flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0),
+                  is_regex: bool = False):
+        try:
+            regex = valid_query(query, is_regex, flags)
+        except InvalidPatternError:
+            self.clear()
+            raise
+        self.__regex = regex
+        matches = find_all(self.__document, query, flags, is_regex)
+        self.__starts = [start for start, _ in matches]
+        self.__ends = [end for _, end in matches]
+        self.__gap = len(matches)
+        self.__current = -1
+        self.__length = self.__document.characterCount()
+        self.__highlight_timer.start()
+        self.changed.emit()
+
+    def clear(self):
+        self.__regex = None
+        self.__loading = False
+        self.__starts, self.__ends = [], []
+        self.__gap = 0
+        self.__current = -1
+        self.__set_highlights([])
+        self.changed.emit()
+
+    def begin(self, regex: QRegularExpression):
+        # Start over for matches that arrive in batches. The document must not
+        # change before finish(), edits only update the length meanwhile.
+        self.__regex = regex
+        self.__loading = True
+        self.__starts, self.__ends = [], []
+        self.__gap = 0
+        self.__current = -1
+        self.__length = self.__document.characterCount()
+        self.changed.emit()
+
+    def extend(self, starts: list[int], ends: list[int]):
+        # The next matches in document order
+        self.__starts.extend(starts)
+        self.__ends.extend(ends)
+        self.__gap = len(self.__starts)
+        self.__highlight_timer.start()
+        self.changed.emit()
+
+    def finish(self):
+        self.__loading = False
+        self.changed.emit()
+
+    def select_from(self, position: int):
+        # Select the first match at or after position, wrapping around
+        if len(self.__starts) == 0:
+            return False
+        self.__select(self.__bisect(position) % len(self.__starts))
+        return True
+
+    def step(self, backward: bool = False):
+        n_matches = len(self.__starts)
+        if n_matches == 0:
+            return False
+
+        cursor = self.__editor.textCursor()
+        if 0 <= self.__current < n_matches and \
+                (cursor.selectionStart(), cursor.selectionEnd()) == self.match(self.__current):
+            # Still on the last match: O(1)
+            i = (self.__current + (-1 if backward else 1)) % n_matches
+        elif backward:
+            # Moved since: start again from the cursor
+            i = (self.__bisect(cursor.selectionStart()) - 1) % n_matches
+        else:
+            i = self.__bisect(cursor.selectionEnd()) % n_matches
+        self.__select(i)
+        return True
+
+    def __select(self, i: int):
+        self.__current = i
+        start, end = self.match(i)
+        cursor = self.__editor.textCursor()
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+        self.__editor.setTextCursor(cursor)
+        self.__highlight_visible()
+        self.changed.emit()
+
+    def __bisect(self, position: int):
+        # Index of the first match starting at or after position
+        i = bisect.bisect_left(self.__starts, position, 0, self.__gap)
+        if i < self.__gap:
+            return i
+        return bisect.bisect_left(self.__starts, position - self.__length, self.__gap)
+
+    def __move_gap(self, i: int):
+        length = self.__length
+        if i < self.__gap:
+            self.__starts[i:self.__gap] = [start - length for start in self.__starts[i:self.__gap]]
+            self.__ends[i:self.__gap] = [end - length for end in self.__ends[i:self.__gap]]
+        elif i > self.__gap:
+            self.__starts[self.__gap:i] = [start + length for start in self.__starts[self.__gap:i]]
+            self.__ends[self.__gap:i] = [end + length for end in self.__ends[self.__gap:i]]
+        self.__gap = i
+
+    def __contents_changed(self, position: int, removed: int, added: int):
+        # The reported counts may include the final paragraph separator, the
+        # change in length is exact.
+        new_length = self.__document.characterCount()
+        delta = new_length - self.__length
+        if self.__regex is None or self.__loading:
+            self.__length = new_length
+            return
+
+        # Rescan the blocks touched by the change
+        first_block = self.__document.findBlock(position)
+        last_block = self.__document.findBlock(min(position + added, new_length - 1))
+        range_start = first_block.position()
+        range_end = last_block.position() + last_block.length()
+        low = self.__bisect(range_start)
+        high = self.__bisect(range_end - delta)
+
+        matches = find_in_blocks(self.__regex, first_block, last_block)
+        self.__move_gap(low)
+        self.__starts[low:high] = [start for start, _ in matches]
+        self.__ends[low:high] = [end for _, end in matches]
+        self.__gap = low + len(matches)
+        self.__length = new_length
+
+        if low <= self.__current < high:
+            self.__current = -1
+        elif self.__current >= high:
+            self.__current += len(matches) - (high - low)
+        self.__highlight_timer.start()
+        self.changed.emit()
+
+    def __update_requested(self, rect: QRect, dy: int):
+        # Scrolling and resizing, not the blinking cursor
+        if self.__regex is not None and (dy != 0 or rect.contains(self.__editor.viewport().rect())):
+            self.__highlight_timer.start()
+
+    def __highlight_visible(self):
+        if self.__regex is None:
+            self.__set_highlights([])
+            return
+
+        viewport = self.__editor.viewport()
+        top = self.__editor.firstVisibleBlock().position()
+        bottom_block = self.__editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        low = self.__bisect(top)
+        high = min(self.__bisect(bottom_block.position() + bottom_block.length()),
+                   low + self.max_highlights)
+
+        selections = []
+        for i in range(low, high):
+            start, end = self.match(i)
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(self.__document)
+            selection.cursor.setPosition(start)
+            selection.cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+            selection.format = self.current_format if i == self.__current else self.match_format
+            selections.append(selection)
+        self.__set_highlights(selections)
+
+    def __set_highlights(self, selections: list[QTextEdit.ExtraSelection]):
+        # The editor is shared, e.g. by the find and replace dialogs: replace
+        # only the selections of this index and keep everyone else's
+        owned: dict[tuple[int, int], list[QTextCharFormat]] = {}
+        for selection in self.__highlights:
+            owned.setdefault((selection.cursor.anchor(), selection.cursor.position()), []).append(selection.format)
+        others = []
+        for selection in self.__editor.extraSelections():
+            formats = owned.get((selection.cursor.anchor(), selection.cursor.position()), [])
+            if selection.format in formats:
+                formats.remove(selection.format)
+            else:
+                others.append(selection)
+        self.__highlights = selections
+        self.__editor.setExtraSelections(others + selections)
+
+
+class SearchWorker(QObject):
+    batch_size = 1000
+
+    # generation, match starts, match ends
+    found = pyqtSignal(int, list, list)
+    # generation, number of matches
+    finished = pyqtSignal(int, int)
+
+    def __init__(self):
+        super().__init__()
+        # Written by the GUI thread, a scan stops once it is outdated
+        self.latest_generation = 0
+
+    def scan(self, generation: int, pieces: list[str], regex: QRegularExpression):
+        if generation != self.latest_generation:
+            return
+        # Selected text separates blocks with U+2029, toPlainText() would give
+        # '\n' and plain spaces. Either way one character stays one character.
+        text = "".join(pieces).replace('\u2029', '\n').replace('\u00a0', ' ')
+
+        starts, ends = [], []
+        n_matches = 0
+        for start, end in find_in_lines(regex, text):
+            starts.append(start)
+            ends.append(end)
+            if len(starts) == self.batch_size:
+                if generation != self.latest_generation:
+                    return
+                self.found.emit(generation, starts, ends)
+                n_matches += len(starts)
+                starts, ends = [], []
+        self.found.emit(generation, starts, ends)
+        self.finished.emit(generation, n_matches + len(starts))
+
+
+# noinspection PyUnresolvedReferences
+class IncrementalSearch(QObject):
+    # Search as the query is typed: debounced, scanned on a worker thread
+    # over a snapshot of the text, and streamed into a MatchIndex.
+    debounce_ms = 150
+    # The snapshot is copied a slice per event loop pass
+    snapshot_chunk_chars = 256 * 1024
+
+    failed = pyqtSignal(str)
+    # Number of matches once the whole document has been scanned
+    finished = pyqtSignal(int)
+
+    # The snapshot pieces go as a Python object, list would copy them all
+    __scan_requested = pyqtSignal(int, object, QRegularExpression)
+
+    def __init__(self, editor: QPlainTextEdit, match_index: MatchIndex, parent=None):
+        super().__init__(parent)
+        self.__editor = editor
+        self.__document = editor.document()
+        self.__match_index = match_index
+        self.__generation = 0
+        self.__scanning = False
+        self.__query: tuple[str, QTextDocument.FindFlag, bool] | None = None
+        # Where the search started, the first match after it gets selected
+        self.__anchor = 0
+
+        # Typing a query does not change the text, so the snapshot is kept
+        # for as long as the document revision stays the same.
+        self.__snapshot: list[str] = []
+        self.__snapshot_revision = -1
+        self.__snapshot_position = 0
+
+        self.__debounce_timer = QTimer(self)
+        self.__debounce_timer.setSingleShot(True)
+        self.__debounce_timer.setInterval(self.debounce_ms)
+        self.__debounce_timer.timeout.connect(self.__start_scan)
+
+        self.__snapshot_timer = QTimer(self)
+        self.__snapshot_timer.setInterval(0)
+        self.__snapshot_timer.timeout.connect(self.__copy_snapshot_chunk)
+
+        # Create thread: QThread, worker: QObject
+        self.__search_thread = QThread(self)
+        self.__search_worker = SearchWorker()
+        self.__search_worker.moveToThread(self.__search_thread)
+        self.__scan_requested.connect(self.__search_worker.scan)
+        self.__search_worker.found.connect(self.__receive_found)
+        self.__search_worker.finished.connect(self.__receive_finished)
+        QApplication.instance().aboutToQuit.connect(self.__stop_search_thread)
+        # The search may go before the application does. Its own slots are
+        # gone by then, so this one only holds what it stops.
+        self.destroyed.connect(functools.partial(self.__stop_thread, self.__search_thread, self.__search_worker))
+        self.__search_thread.start()
+
+        self.__document.contentsChange.connect(self.__contents_changed)
+
+    def search(self, query: str, flags: QTextDocument.FindFlag = QTextDocument.FindFlag(0),
+               is_regex: bool = False):
+        if not self.__debounce_timer.isActive() and not self.__scanning:
+            self.__anchor = self.__editor.textCursor().selectionStart()
+        self.__query = (query, flags & ~QTextDocument.FindFlag.FindBackward, is_regex)
+        self.__debounce_timer.start()
+
+    def cancel(self):
+        self.__debounce_timer.stop()
+        self.__snapshot_timer.stop()
+        self.__query = None
+        self.__outdate_scan()
+
+    def __outdate_scan(self):
+        self.__generation += 1
+        self.__search_worker.latest_generation = self.__generation
+        self.__scanning = False
+
+    def __start_scan(self):
+        self.__outdate_scan()
+        if self.__query is None:
+            return
+        query, flags, is_regex = self.__query
+        if len(query) == 0:
+            self.__snapshot_timer.stop()
+            self.__match_index.clear()
+            return
+        try:
+            valid_query(query, is_regex, flags)
+        except InvalidPatternError as e:
+            self.__snapshot_timer.stop()
+            self.__match_index.clear()
+            self.failed.emit(str(e))
+            return
+
+        if self.__document.revision() == self.__snapshot_revision and \
+                not self.__snapshot_timer.isActive():
+            self.__dispatch_scan()
+        elif not self.__snapshot_timer.isActive():
+            self.__restart_snapshot()
+            self.__snapshot_timer.start()
+
+    def __restart_snapshot(self):
+        self.__snapshot = []
+        self.__snapshot_revision = self.__document.revision()
+        self.__snapshot_position = 0
+
+    def __copy_snapshot_chunk(self):
+        if self.__document.revision() != self.__snapshot_revision:
+            self.__restart_snapshot()
+
+        end_position = self.__document.characterCount() - 1
+        start = self.__snapshot_position
+        end = min(start + self.snapshot_chunk_chars, end_position)
+        # Never split a surrogate pair between two slices
+        if end < end_position and 0xD800 <= ord(self.__document.characterAt(end - 1)) <= 0xDBFF:
+            end += 1
+        cursor = QTextCursor(self.__document)
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+        self.__snapshot.append(cursor.selectedText())
+        self.__snapshot_position = end
+
+        if end >= end_position:
+            self.__snapshot_timer.stop()
+            self.__dispatch_scan()
+
+    def __dispatch_scan(self):
+        # The latest query, which may have changed while copying
+        query, flags, is_regex = self.__query
+        regex = valid_query(query, is_regex, flags)
+        self.__outdate_scan()
+        self.__scanning = True
+        self.__match_index.begin(regex)
+        self.__scan_requested.emit(self.__generation, self.__snapshot, regex)
+
+    def __receive_found(self, generation: int, starts: list[int], ends: list[int]):
+        if generation == self.__generation and self.__scanning:
+            self.__match_index.extend(starts, ends)
+
+    def __receive_finished(self, generation: int, n_matches: int):
+        if generation != self.__generation or not self.__scanning:
+            return
+        self.__scanning = False
+        self.__match_index.finish()
+        self.__match_index.select_from(self.__anchor)
+        self.finished.emit(n_matches)
+
+    def __contents_changed(self):
+        # The snapshot being scanned is stale, scan again once typing pauses
+        if self.__scanning:
+            self.__outdate_scan()
+            self.__debounce_timer.start()
+
+    def __stop_search_thread(self):
+        self.cancel()
+        self.__stop_thread(self.__search_thread, self.__search_worker)
+
+    @staticmethod
+    def __stop_thread(search_thread: QThread, search_worker: SearchWorker):
+        # A running scan stops at its next batch
+        search_worker.latest_generation = -1
+        search_thread.quit()
+        search_thread.wait()
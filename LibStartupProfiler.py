@@ -0,0 +1,107 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Imported before PyQt6 so that its import is part of the profile; Qt is
+# only imported once watching starts.
+import json
+import os
+import sys
+import time
+
+# EASYTYPING_PROFILE_STARTUP=1 or --profile-startup prints the phases to
+# stderr once the first keystroke is accepted; any other value of the
+# variable is a file to append them to as a JSON line.
+profile_variable = "EASYTYPING_PROFILE_STARTUP"
+profile_flag = "--profile-startup"
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        setting = os.environ.get(profile_variable, "")
+        self.enabled = len(setting) > 0 or profile_flag in sys.argv
+        self.output_path = setting if setting not in ("", "1") else ""
+        # (phase, perf_counter time), in the order they happened
+        self.marks: list[tuple[str, float]] = []
+        self.__watcher = None
+
+    def mark(self, phase: str):
+        if self.enabled:
+            self.marks.append((phase, time.perf_counter()))
+
+    def elapsed_ms(self):
+        # {phase: ms since the profiler was imported}, first time each phase
+        elapsed: dict[str, float] = {}
+        for phase, mark_time in self.marks:
+            elapsed.setdefault(phase, (mark_time - self.start_time) * 1000)
+        return elapsed
+
+    def watch(self, editor):
+        # Marks the first paint of the editor and the first keystroke which
+        # changes its text, then reports
+        if not self.enabled or self.__watcher is not None:
+            return
+        from PyQt6.QtCore import QEvent, QObject
+
+        profiler = self
+
+        class EditorWatcher(QObject):
+            def __init__(self):
+                super().__init__()
+                self.key_pressed = False
+
+            def eventFilter(self, watched, event):
+                if event.type() == QEvent.Type.Paint and watched is editor.viewport():
+                    profiler.mark("first paint")
+                    watched.removeEventFilter(self)
+                elif event.type() == QEvent.Type.KeyPress and watched is editor:
+                    self.key_pressed = True
+                return False
+
+            def text_changed(self):
+                if not self.key_pressed:
+                    return
+                profiler.mark("first keystroke")
+                editor.textChanged.disconnect(self.text_changed)
+                editor.removeEventFilter(self)
+                editor.viewport().removeEventFilter(self)
+                profiler.report()
+
+        self.__watcher = EditorWatcher()
+        editor.installEventFilter(self.__watcher)
+        editor.viewport().installEventFilter(self.__watcher)
+        editor.textChanged.connect(self.__watcher.text_changed)
+
+    def report(self):
+        elapsed = self.elapsed_ms()
+        if len(self.output_path) > 0:
+            try:
+                with open(self.output_path, "a", encoding="UTF-8") as file:
+                    file.write(json.dumps(elapsed) + '\n')
+            except OSError as e:
+                print(f"Cannot write the startup profile: {e}", file=sys.stderr)
+            return
+
+        print("Startup profile, ms since start:", file=sys.stderr)
+        last_ms = 0.0
+        for phase, phase_ms in elapsed.items():
+            print(f"  {phase:<24}{phase_ms:9.1f}{phase_ms - last_ms:+9.1f}", file=sys.stderr)
+            last_ms = phase_ms
+
+
+startup_profiler = StartupProfiler()
@@ -19,10 +19,17 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from PyQt6.QtWidgets import (
     QWidget, QDockWidget, QHBoxLayout, QVBoxLayout,
     QLineEdit, QPlainTextEdit, QPushButton, QLabel,
-    QMessageBox
+    QMessageBox, QApplication, QCheckBox
 )
-from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal
-import requests
+from PyQt6.QtGui import QTextCursor
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from LibThesaurusCache import ThesaurusCache
+from LibThesaurusBackend import (
+    ThesaurusBackend, ThesaurusLookupError, ApiNinjasBackend, LocalThesaurusBackend
+)
+import os
+import re
+import time
 
 
 # Load api-key when the library is imported
@@ -32,27 +39,135 @@ try:
 except FileExistsError:
     my_api_key = ""
 
+local_index_path = "assets/thesaurus.idx"
+
+
+def create_default_backend(pool_size: int = 4):
+    # Prefer the offline index when one has been built
+    if os.path.exists(local_index_path):
+        try:
+            return LocalThesaurusBackend(local_index_path)
+        except (OSError, ValueError, ThesaurusLookupError):
+            pass
+    return ApiNinjasBackend(my_api_key, pool_size)
+
 
 # noinspection PyUnresolvedReferences
-class ThesaurusDictWorker(QObject):
-    got_response = pyqtSignal(requests.Response)
-    finished = pyqtSignal()
-    __inquire_token: str
+class ThesaurusDictWorkerSignals(QObject):
+    got_result = pyqtSignal(str, dict)
+    failed = pyqtSignal(str, str)
+    finished = pyqtSignal(str)
+
 
-    def set_token(self, token: str):
+class ThesaurusDictWorker(QRunnable):
+    def __init__(self, backend: ThesaurusBackend, token: str):
+        super().__init__()
+        self.signals = ThesaurusDictWorkerSignals()
+        self.__backend = backend
         self.__inquire_token = token
 
     def run(self):
-        api_url = 'https://api.api-ninjas.com/v1/thesaurus?word={}'\
-            .format(self.__inquire_token)
-        response = requests.get(api_url, headers={'X-Api-Key': f'{my_api_key}'})
-        self.got_response.emit(response)
-        self.finished.emit()
+        try:
+            result = self.__backend.lookup(self.__inquire_token)
+        except ThesaurusLookupError as e:
+            self.signals.failed.emit(self.__inquire_token, str(e))
+        else:
+            self.signals.got_result.emit(self.__inquire_token, result)
+        self.signals.finished.emit(self.__inquire_token)
+
+
+# noinspection PyUnresolvedReferences
+class ThesaurusLookupScheduler(QObject):
+    result_ready = pyqtSignal(str, dict)
+    lookup_failed = pyqtSignal(str, str)
+
+    def __init__(self, cache: ThesaurusCache, backend: ThesaurusBackend | None = None,
+                 max_in_flight: int = 4, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.backend = backend if backend is not None else create_default_backend(max_in_flight)
+        self.__pool = QThreadPool(self)
+        self.__pool.setMaxThreadCount(max_in_flight)
+
+        # Queued or running lookups by normalized word, with their priority
+        self.__pending: dict[str, tuple[ThesaurusDictWorker, int]] = {}
+
+        QApplication.instance().aboutToQuit.connect(self.__stop_pool)
+
+    def lookup(self, token: str, priority: int = 0, supersede: bool = False):
+        key = ThesaurusCache.normalize(token)
+        cached_result = self.cache.get(key) if self.backend.is_remote else None
+        if cached_result is not None:
+            self.result_ready.emit(key, cached_result)
+            return False
+
+        if supersede:
+            # Drop queued lookups that the user no longer waits for
+            for other_key, (worker, other_priority) in list(self.__pending.items()):
+                if other_key == key or other_priority > priority:
+                    continue
+                try:
+                    taken = self.__pool.tryTake(worker)
+                except RuntimeError:
+                    # Already run and deleted, its finished signal is queued
+                    taken = False
+                if taken:
+                    del self.__pending[other_key]
+
+        if key in self.__pending:
+            return False
+
+        worker = ThesaurusDictWorker(self.backend, key)
+        # Kept alive by __pending until its finished signal arrives, so a
+        # worker which already ran can still be passed to tryTake
+        worker.setAutoDelete(False)
+        worker.signals.got_result.connect(self.__receive_result)
+        worker.signals.failed.connect(self.lookup_failed)
+        worker.signals.finished.connect(self.__finish_lookup)
+        self.__pending[key] = (worker, priority)
+        self.__pool.start(worker, priority)
+        return True
+
+    def lookup_blocking(self, token: str):
+        key = ThesaurusCache.normalize(token)
+        cached_result = self.cache.get(key) if self.backend.is_remote else None
+        if cached_result is not None:
+            return cached_result, ""
+        try:
+            result = self.backend.lookup(key)
+        except ThesaurusLookupError as e:
+            return None, str(e)
+        if self.backend.is_remote:
+            self.cache.put(key, result)
+        return result, ""
+
+    def is_pending(self, token: str):
+        return ThesaurusCache.normalize(token) in self.__pending
+
+    def __receive_result(self, key: str, result: dict):
+        if self.backend.is_remote:
+            self.cache.put(key, result)
+        self.result_ready.emit(key, result)
+
+    def __finish_lookup(self, key: str):
+        self.__pending.pop(key, None)
+
+    def __stop_pool(self):
+        self.__pool.clear()
+        self.__pool.waitForDone()
+        self.backend.close()
+        self.cache.close()
 
 
 # noinspection PyUnresolvedReferences
 class ThesaurusDictWidget(QDockWidget):
-    def __init__(self):
+    prefetch_delay_ms = 400
+    prefetch_interval_s = 1.5
+    prefetch_budget = 200
+    prefetch_priority = -1
+
+    def __init__(self, cache: ThesaurusCache | None = None,
+                 backend: ThesaurusBackend | None = None):
         super().__init__()
         self.setWindowTitle("Thesaurus")
         self.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea |
@@ -80,10 +195,14 @@ class ThesaurusDictWidget(QDockWidget):
         self.__antonyms_result.setReadOnly(True)
         antonyms_layout.addWidget(self.__antonyms_result)
 
+        self.__prefetch_checkbox = QCheckBox("Prefetch the word at the cursor")
+        self.__prefetch_checkbox.setChecked(False)
+
         wrap_layout = QVBoxLayout()
         wrap_layout.addLayout(entry_layout)
         wrap_layout.addLayout(synonyms_layout)
         wrap_layout.addLayout(antonyms_layout)
+        wrap_layout.addWidget(self.__prefetch_checkbox)
         wrap_widget = QWidget()
         wrap_widget.setLayout(wrap_layout)
         self.setWidget(wrap_widget)
@@ -91,9 +210,68 @@ class ThesaurusDictWidget(QDockWidget):
         self.__inquiry_btn.clicked.connect(self.__inquiry_handler)
         self.__entry_widget.returnPressed.connect(self.__inquiry_handler)
 
-        # Create thread: QThread, worker: QObject
-        self.__async_thread = QThread()
-        self.__async_worker = ThesaurusDictWorker()
+        self.cache = cache if cache is not None else ThesaurusCache()
+
+        self.scheduler = ThesaurusLookupScheduler(self.cache, backend, parent=self)
+        self.scheduler.result_ready.connect(self.__receive_result)
+        self.scheduler.lookup_failed.connect(self.__receive_error)
+        self.__current_key = ""
+
+        # Background prefetch of the word at the editor cursor
+        self.__watched_editor: QPlainTextEdit | None = None
+        self.__prefetch_key = ""
+        self.__last_prefetch_time = 0.0
+        self.prefetch_count = 0
+        self.__prefetch_timer = QTimer(self)
+        self.__prefetch_timer.setSingleShot(True)
+        self.__prefetch_timer.timeout.connect(self.__prefetch_word_at_cursor)
+        self.__prefetch_checkbox.toggled.connect(self.__prefetch_toggled)
+
+    def watch_editor(self, editor: QPlainTextEdit):
+        self.__watched_editor = editor
+        editor.cursorPositionChanged.connect(self.__editor_cursor_moved)
+
+    def __prefetch_toggled(self, checked: bool):
+        if checked:
+            self.__editor_cursor_moved()
+        else:
+            self.__prefetch_timer.stop()
+
+    def __editor_cursor_moved(self):
+        # Only restart a timer here, this runs on every keystroke
+        if self.__prefetch_checkbox.isChecked():
+            self.__prefetch_timer.start(self.prefetch_delay_ms)
+
+    def __prefetch_word_at_cursor(self):
+        if self.__watched_editor is None or self.prefetch_count >= self.prefetch_budget:
+            return
+
+        cursor = self.__watched_editor.textCursor()
+        cursor.select(QTextCursor.SelectionType.WordUnderCursor)
+        word = cursor.selectedText()
+        if re.fullmatch(r"[^\W\d_]{3,}", word) is None:
+            return
+        key = ThesaurusCache.normalize(word)
+        if key == self.__prefetch_key:
+            return
+
+        # Rate limit and retry with the newest word once the interval is over
+        wait_s = self.__last_prefetch_time + self.prefetch_interval_s - time.monotonic()
+        if wait_s > 0:
+            self.__prefetch_timer.start(int(wait_s * 1000) + 1)
+            return
+
+        self.__prefetch_key = key
+        if self.scheduler.lookup(key, self.prefetch_priority, supersede=True):
+            self.__last_prefetch_time = time.monotonic()
+            self.prefetch_count += 1
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Cached answers show at once, pending ones as soon as they arrive
+        if self.__prefetch_checkbox.isChecked() and len(self.__prefetch_key) > 0:
+            self.__entry_widget.setText(self.__prefetch_key)
+            self.inquire_async(self.__prefetch_key)
 
     def __inquiry_handler(self):
         token = self.__entry_widget.text()
@@ -104,46 +282,24 @@ class ThesaurusDictWidget(QDockWidget):
         self.inquire_async(token)
 
     def inquire_async(self, token: str):
-        if self.__async_thread.isRunning():
-            QMessageBox.warning(self, "Info",
-                                "The thesaurus is busy.\n"
-                                "Please try again later.")
+        # Only the latest inquiry is shown; earlier queued ones are cancelled
+        self.__current_key = ThesaurusCache.normalize(token)
+        self.__synonyms_result.setPlainText("Searching...")
+        self.__antonyms_result.setPlainText("Searching...")
+        self.scheduler.lookup(token, supersede=True)
+
+    def __receive_result(self, key: str, result: dict):
+        if key == self.__current_key:
+            self.__show_result(result)
+
+    def __receive_error(self, key: str, message: str):
+        if key != self.__current_key:
             return
+        self.__synonyms_result.clear()
+        self.__antonyms_result.clear()
+        QMessageBox.warning(self, "Error", message)
 
-        # Disable/Disconnect Related UI
-        self.__entry_widget.setEnabled(False)
-        self.__inquiry_btn.setEnabled(False)
-
-        # Load worker into thread
-        self.__async_worker.moveToThread(self.__async_thread)
-
-        # Assign input parameters
-        self.__async_worker.set_token(token)
-
-        # Connect thread.started -> worker.run
-        self.__async_thread.started.connect(self.__async_worker.run)
-
-        # Connect Worker.got_response -> self.async_stop with response: Response
-        self.__async_worker.got_response.connect(self.__inquire_async_receive_response)
-
-        # Connect worker.finish -> thread.quit
-        self.__async_worker.finished.connect(self.__async_thread.quit)
-
-        # Start Async Thread
-        self.__async_thread.start()
-
-    def __inquire_async_receive_response(self, response: requests.Response):
-        self.__process_response(response)
-        self.__entry_widget.setEnabled(True)
-        self.__inquiry_btn.setEnabled(True)
-
-    def __process_response(self, response: requests.Response):
-        if response.status_code != requests.codes.ok:
-            QMessageBox.warning(self, "Error",
-                                f"Error {response.status_code}: {response.text}")
-            return None
-        result = response.json()
-
+    def __show_result(self, result: dict):
         def build_str_from_list(str_list: list[str]):
             result_str = ""
             for i, str_token in enumerate(str_list):
@@ -169,9 +325,12 @@ class ThesaurusDictWidget(QDockWidget):
         self.__entry_widget.setEnabled(False)
         self.__inquiry_btn.setEnabled(False)
 
-        api_url = 'https://api.api-ninjas.com/v1/thesaurus?word={}'.format(token)
-        response = requests.get(api_url, headers={'X-Api-Key': f'{my_api_key}'})
-        self.__process_response(response)
+        self.__current_key = ThesaurusCache.normalize(token)
+        result, error = self.scheduler.lookup_blocking(token)
+        if result is None:
+            QMessageBox.warning(self, "Error", error)
+        else:
+            self.__show_result(result)
 
         self.__entry_widget.setEnabled(True)
         self.__inquiry_btn.setEnabled(True)
@@ -185,8 +344,7 @@ class ThesaurusDictWidget(QDockWidget):
 
 if __name__ == "__main__":
     import sys
-    from PyQt6.QtWidgets import (
-        QApplication, QMainWindow, QTextEdit)
+    from PyQt6.QtWidgets import QMainWindow, QTextEdit
     from PyQt6.QtCore import Qt
 
     app = QApplication(sys.argv)
@@ -0,0 +1,213 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import mmap
+import os
+import struct
+
+import requests
+import requests.adapters
+
+api_url_template = 'https://api.api-ninjas.com/v1/thesaurus?word={}'
+request_timeout = (5, 15)
+
+# Local index layout (little endian):
+#   magic       8 bytes
+#   n_records   uint64
+#   offsets     uint64 * (n_records + 1), relative to the first record
+#   records     "word\tsyn,syn\tant,ant\n" in UTF-8, sorted by word bytes
+index_magic = b"ETTHES01"
+index_header = struct.Struct("<8sQ")
+index_offset = struct.Struct("<Q")
+
+
+class ThesaurusLookupError(Exception):
+    pass
+
+
+class ThesaurusBackend:
+    # Remote answers are worth caching, local ones are already cheap
+    is_remote = False
+
+    def lookup(self, word: str) -> dict:
+        # Subclasses answer with {"word", "synonyms", "antonyms"}
+        # or raise ThesaurusLookupError
+        ...
+
+    def close(self):
+        ...
+
+
+class ApiNinjasBackend(ThesaurusBackend):
+    is_remote = True
+
+    def __init__(self, api_key: str, pool_size: int = 4):
+        # Keep-alive connections are shared by every lookup
+        self.__session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=pool_size)
+        self.__session.mount("https://", adapter)
+        self.__session.headers.update({'X-Api-Key': f'{api_key}'})
+
+    def lookup(self, word: str):
+        try:
+            response = self.__session.get(api_url_template.format(word),
+                                          timeout=request_timeout)
+        except requests.RequestException as e:
+            raise ThesaurusLookupError(f"Error: {e}")
+        if response.status_code != requests.codes.ok:
+            raise ThesaurusLookupError(f"Error {response.status_code}: {response.text}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ThesaurusLookupError(f"Error: {e}")
+
+    def close(self):
+        self.__session.close()
+
+
+class LocalThesaurusBackend(ThesaurusBackend):
+    # Binary search over a memory-mapped sorted string table. Only the pages
+    # touched by a lookup are read from disk.
+    def __init__(self, path: str = "assets/thesaurus.idx"):
+        self.path = path
+        with open(path, "rb") as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < index_header.size:
+            raise ThesaurusLookupError(f"{path} is not a thesaurus index.")
+        magic, self.__n_records = index_header.unpack_from(self.__map, 0)
+        if magic != index_magic:
+            raise ThesaurusLookupError(f"{path} is not a thesaurus index.")
+        self.__records_start = index_header.size + \
+            index_offset.size * (self.__n_records + 1)
+
+    def __len__(self):
+        return self.__n_records
+
+    def __record_span(self, i: int):
+        start, end = struct.unpack_from("<2Q", self.__map,
+                                        index_header.size + index_offset.size * i)
+        return self.__records_start + start, self.__records_start + end
+
+    def lookup(self, word: str):
+        key = word.strip().lower().encode("utf-8")
+        low, high = 0, self.__n_records
+        while low < high:
+            mid = (low + high) // 2
+            start, end = self.__record_span(mid)
+            key_end = self.__map.find(b"\t", start, end)
+            record_key = self.__map[start:key_end]
+            if record_key < key:
+                low = mid + 1
+            elif record_key > key:
+                high = mid
+            else:
+                record = self.__map[key_end + 1:end - 1].decode("utf-8")
+                synonyms, antonyms = record.split("\t")
+                return {"word": word,
+                        "synonyms": synonyms.split(",") if len(synonyms) > 0 else [],
+                        "antonyms": antonyms.split(",") if len(antonyms) > 0 else []}
+        return {"word": word, "synonyms": [], "antonyms": []}
+
+    def close(self):
+        self.__map.close()
+
+
+def parse_word_list_line(line: str):
+    # "word,syn,syn,..." as in the Moby thesaurus, or "word|syn,syn|ant,ant"
+    line = line.strip()
+    if len(line) == 0 or line.startswith('#'):
+        return None
+    fields = line.split('|')
+    if len(fields) == 1:
+        items = [item.strip() for item in fields[0].split(',')]
+        word, synonyms, antonyms = items[0], items[1:], []
+    else:
+        word = fields[0]
+        synonyms = fields[1].split(',')
+        antonyms = fields[2].split(',') if len(fields) > 2 else []
+
+    def clean(items: list[str]):
+        return [item.strip() for item in items if len(item.strip()) > 0]
+
+    return word.strip().lower(), clean(synonyms), clean(antonyms)
+
+
+def build_index(source_path: str, index_path: str, encoding: str = "UTF-8"):
+    def join_items(items: dict[str, None]):
+        return ','.join(item.replace(',', ' ').replace('\t', ' ') for item in items)
+
+    # Dicts keep the first-seen order of merged synonyms without duplicates
+    entries: dict[str, tuple[dict[str, None], dict[str, None]]] = {}
+    with open(source_path, "r", encoding=encoding, errors="ignore") as file:
+        for line in file:
+            parsed = parse_word_list_line(line)
+            if parsed is None or len(parsed[0]) == 0:
+                continue
+            word, synonyms, antonyms = parsed
+            known_synonyms, known_antonyms = entries.setdefault(word, ({}, {}))
+            known_synonyms.update(dict.fromkeys(synonyms))
+            known_antonyms.update(dict.fromkeys(antonyms))
+
+    records = []
+    for word, (synonyms, antonyms) in entries.items():
+        records.append(word.replace('\t', ' ').encode("utf-8") + b"\t" +
+                       join_items(synonyms).encode("utf-8") + b"\t" +
+                       join_items(antonyms).encode("utf-8") + b"\n")
+    records.sort(key=lambda record: record[:record.index(b"\t")])
+
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    # Write next to the target and rename, so readers never see a partial index
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(index_header.pack(index_magic, len(records)))
+        file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        file.writelines(records)
+    os.replace(temp_path, index_path)
+    return len(records)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build or query a local thesaurus index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build an index from a word list.")
+    build_parser.add_argument("source", help="Word list: 'word,syn,...' or 'word|syn,...|ant,...' per line.")
+    build_parser.add_argument("index", nargs="?", default="assets/thesaurus.idx")
+    build_parser.add_argument("--encoding", default="UTF-8")
+    query_parser = subparsers.add_parser("query", help="Look up words in an index.")
+    query_parser.add_argument("index")
+    query_parser.add_argument("words", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n_words = build_index(args.source, args.index, args.encoding)
+        print(f"Indexed {n_words} words into {args.index}.")
+    else:
+        backend = LocalThesaurusBackend(args.index)
+        for query_word in args.words:
+            start_time = time.perf_counter()
+            query_result = backend.lookup(query_word)
+            elapsed_us = (time.perf_counter() - start_time) * 1e6
+            print(f"{query_word} ({elapsed_us:.1f} us): {query_result}")
+        backend.close()
@@ -0,0 +1,193 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+import json
+import sqlite3
+import time
+
+
+class ThesaurusCache:
+    # Two tiers: an in-memory LRU in front of an SQLite store on disk.
+    # Both tiers expire entries after ttl_seconds.
+    max_pending_accesses = 256
+
+    def __init__(self, path: str = "assets/thesaurus_cache.sqlite3",
+                 ttl_seconds: float = 30 * 24 * 3600,
+                 max_memory_entries: int = 512,
+                 max_disk_entries: int = 20000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.__memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.__connection: sqlite3.Connection | None = None
+        self.__disk_enabled = len(path) > 0
+        # Access times of disk hits not written yet, so reads stay reads.
+        # They are written with the next store, which evicts by them.
+        self.__pending_accesses: dict[str, float] = {}
+
+    @staticmethod
+    def normalize(word: str):
+        return word.strip().lower()
+
+    def get(self, word: str):
+        key = self.normalize(word)
+        now = time.time()
+
+        entry = self.__memory.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if now - stored_at <= self.ttl_seconds:
+                self.__memory.move_to_end(key)
+                self.memory_hits += 1
+                return result
+            del self.__memory[key]
+
+        entry = self.__disk_get(key, now)
+        if entry is not None:
+            stored_at, result = entry
+            self.__memory_put(key, stored_at, result)
+            self.disk_hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, word: str, result: dict):
+        key = self.normalize(word)
+        now = time.time()
+        self.__memory_put(key, now, result)
+        self.__disk_put(key, now, result)
+
+    def clear(self):
+        self.__memory.clear()
+        connection = self.__connect()
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute("DELETE FROM thesaurus")
+        except sqlite3.Error:
+            self.__disable_disk()
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.__memory),
+        }
+
+    def close(self):
+        if self.__connection is not None:
+            try:
+                with self.__connection:
+                    self.__write_accesses(self.__connection)
+            except sqlite3.Error:
+                pass
+            self.__connection.close()
+            self.__connection = None
+        self.__pending_accesses.clear()
+
+    def __memory_put(self, key: str, stored_at: float, result: dict):
+        self.__memory[key] = (stored_at, result)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_memory_entries:
+            self.__memory.popitem(last=False)
+
+    def __connect(self):
+        if not self.__disk_enabled:
+            return None
+        if self.__connection is not None:
+            return self.__connection
+        try:
+            connection = sqlite3.connect(self.path)
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS thesaurus ("
+                                   "word TEXT PRIMARY KEY, "
+                                   "result TEXT NOT NULL, "
+                                   "stored_at REAL NOT NULL, "
+                                   "accessed_at REAL NOT NULL)")
+                connection.execute("CREATE INDEX IF NOT EXISTS thesaurus_accessed_at "
+                                   "ON thesaurus (accessed_at)")
+                connection.execute("DELETE FROM thesaurus WHERE stored_at < ?",
+                                   (time.time() - self.ttl_seconds,))
+        except sqlite3.Error:
+            self.__disk_enabled = False
+            return None
+        self.__connection = connection
+        return connection
+
+    def __disable_disk(self):
+        # Keep serving from memory if the disk store is unusable
+        self.close()
+        self.__disk_enabled = False
+
+    def __disk_get(self, key: str, now: float):
+        connection = self.__connect()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute("SELECT result, stored_at FROM thesaurus WHERE word = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            result_str, stored_at = row
+            if now - stored_at > self.ttl_seconds:
+                with connection:
+                    connection.execute("DELETE FROM thesaurus WHERE word = ?", (key,))
+                return None
+            self.__pending_accesses[key] = now
+            if len(self.__pending_accesses) >= self.max_pending_accesses:
+                with connection:
+                    self.__write_accesses(connection)
+            return stored_at, json.loads(result_str)
+        except (sqlite3.Error, ValueError):
+            self.__disable_disk()
+            return None
+
+    def __disk_put(self, key: str, now: float, result: dict):
+        connection = self.__connect()
+        if connection is None:
+            return
+        try:
+            with connection:
+                self.__write_accesses(connection)
+                connection.execute("INSERT OR REPLACE INTO thesaurus "
+                                   "(word, result, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(result), now, now))
+                connection.execute("DELETE FROM thesaurus WHERE word IN ("
+                                   "SELECT word FROM thesaurus ORDER BY accessed_at DESC "
+                                   "LIMIT -1 OFFSET ?)",
+                                   (self.max_disk_entries,))
+        except sqlite3.Error:
+            self.__disable_disk()
+
+    def __write_accesses(self, connection: sqlite3.Connection):
+        # Inside the caller's transaction
+        if len(self.__pending_accesses) == 0:
+            return
+        connection.executemany("UPDATE thesaurus SET accessed_at = ? WHERE word = ?",
+                               [(accessed_at, key) for key, accessed_at in self.__pending_accesses.items()])
+        self.__pending_accesses.clear()
@@ -0,0 +1,241 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6.QtCore import QEvent, QObject, QTimer, Qt, pyqtSignal
+from PyQt6.QtGui import QInputMethodEvent, QKeyEvent
+from PyQt6.QtWidgets import QApplication, QPlainTextEdit
+import json
+import os
+import random
+import re
+import sys
+import time
+
+# EASYTYPING_RECORD_TYPING=1 or --record-typing records the timing of every
+# keystroke into assets/typing_sessions on quit; any other value of the
+# variable is the file to write. The typed text is masked unless
+# EASYTYPING_RECORD_CONTENT=1.
+record_variable = "EASYTYPING_RECORD_TYPING"
+record_flag = "--record-typing"
+content_variable = "EASYTYPING_RECORD_CONTENT"
+session_directory = "assets/typing_sessions"
+session_format = 1
+
+# Masking hides every letter and digit of any script, in the text and the
+# key of each event, but keeps the words and their lengths. Each is
+# replaced by a character the word counter treats alike, so the word count
+# of a replay matches the session.
+word_character_pattern = re.compile(r'[^\W_]')
+latin_pattern = re.compile(r'[A-Za-z0-9]')
+chinese_pattern = re.compile(r'[一-龥]')
+
+# Event kinds: key presses, and text committed by an input method
+key_event = "key"
+commit_event = "commit"
+
+sample_words = ("the quick brown fox jumps over lazy dog and writer keeps typing without looking back "
+                "every morning words come slowly then all at once").split()
+
+
+def mask_character(match: re.Match):
+    character = match.group()
+    if chinese_pattern.match(character):
+        return "字"
+    if latin_pattern.match(character):
+        return "x"
+    # Letters the word counter does not count, e.g. é, Cyrillic or kana
+    return "ø"
+
+
+def mask_text(text: str):
+    return word_character_pattern.sub(mask_character, text)
+
+
+def mask_key(key: int, modifiers: int, text: str):
+    # Keys of letters and digits are their upper case character, of any
+    # script. They become X like the masked text, except in shortcuts,
+    # which type no letters and would replay as another shortcut.
+    shortcut_modifiers = (Qt.KeyboardModifier.ControlModifier.value | Qt.KeyboardModifier.AltModifier.value |
+                          Qt.KeyboardModifier.MetaModifier.value)
+    if modifiers & shortcut_modifiers != 0 and word_character_pattern.search(text) is None:
+        return key
+    if key <= sys.maxunicode and word_character_pattern.match(chr(key)):
+        return Qt.Key.Key_X.value
+    return key
+
+
+class TypingRecorder(QObject):
+    def __init__(self):
+        super().__init__()
+        setting = os.environ.get(record_variable, "")
+        self.enabled = len(setting) > 0 or record_flag in sys.argv
+        self.output_path = setting if setting not in ("", "1") else ""
+        self.record_content = os.environ.get(content_variable, "") == "1"
+        # (seconds since the first event, kind, key, modifiers, text)
+        self.events: list[tuple[float, str, int, int, str]] = []
+        self.__start_time: float | None = None
+        self.__editor: QPlainTextEdit | None = None
+
+    def watch(self, editor: QPlainTextEdit):
+        if not self.enabled or self.__editor is not None:
+            return
+        self.__editor = editor
+        editor.installEventFilter(self)
+        QApplication.instance().aboutToQuit.connect(self.__save_session)
+
+    def eventFilter(self, watched: QObject, event: QEvent):
+        if event.type() == QEvent.Type.KeyPress:
+            self.__record(key_event, event.key(), event.modifiers().value, event.text())
+        elif event.type() == QEvent.Type.InputMethod and len(event.commitString()) > 0:
+            self.__record(commit_event, 0, 0, event.commitString())
+        return False
+
+    def __record(self, kind: str, key: int, modifiers: int, text: str):
+        now = time.perf_counter()
+        if self.__start_time is None:
+            self.__start_time = now
+        if not self.record_content:
+            key = mask_key(key, modifiers, text)
+            text = mask_text(text)
+        self.events.append((now - self.__start_time, kind, key, modifiers, text))
+
+    def __save_session(self):
+        if len(self.events) == 0:
+            return
+        path = self.output_path
+        if len(path) == 0:
+            path = os.path.join(session_directory, time.strftime("session-%Y%m%d-%H%M%S.jsonl"))
+        try:
+            save_session(path, self.events, self.record_content)
+        except OSError as e:
+            print(f"Cannot write the typing session: {e}", file=sys.stderr)
+
+
+def save_session(path: str, events: list[tuple[float, str, int, int, str]], has_content: bool = False):
+    # A header line, then one JSON list per event
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="UTF-8") as file:
+        file.write(json.dumps({"format": session_format, "content": has_content, "n_events": len(events)}) + '\n')
+        for event in events:
+            file.write(json.dumps(list(event), ensure_ascii=False) + '\n')
+
+
+def load_session(path: str):
+    with open(path, encoding="UTF-8") as file:
+        header = json.loads(file.readline())
+        if header.get("format") != session_format:
+            raise ValueError(f"{path} is not a typing session of format {session_format}")
+        events = [tuple(json.loads(line)) for line in file if len(line.strip()) > 0]
+    return header, events
+
+
+def synthetic_session(n_words: int = 200, words_per_minute: float = 50.0, seed: int = 0,
+                      sentence_words: int = 12, pause_seconds: tuple[float, float] = (0.5, 3.0),
+                      typo_rate: float = 0.03):
+    # Bursts of words at the given speed, with typos taken back and a
+    # thinking pause after every sentence
+    rng = random.Random(seed)
+    key_seconds = 60 / (words_per_minute * 5)
+    events = []
+    now = 0.0
+
+    def press(key: int, text: str, seconds: float):
+        nonlocal now
+        events.append((now, key_event, key, 0, text))
+        now += seconds * rng.uniform(0.5, 1.5)
+
+    for i in range(n_words):
+        word = rng.choice(sample_words)
+        for character in word:
+            if rng.random() < typo_rate:
+                press(Qt.Key.Key_X.value, "x", key_seconds)
+                press(Qt.Key.Key_Backspace.value, "\b", key_seconds * 2)
+            press(Qt.Key.Key_A.value + ord(character) - ord('a'), character, key_seconds)
+        if (i + 1) % sentence_words == 0:
+            press(Qt.Key.Key_Period.value, ".", key_seconds)
+            press(Qt.Key.Key_Space.value, " ", key_seconds)
+            now += rng.uniform(*pause_seconds)
+        else:
+            press(Qt.Key.Key_Space.value, " ", key_seconds)
+    return events
+
+
+# noinspection PyUnresolvedReferences
+class TypingReplayer(QObject):
+    # Sends the events of a session to an editor as typing would,
+    # speed times faster than they were typed, or back to back at speed 0
+    finished = pyqtSignal()
+
+    def __init__(self, editor: QPlainTextEdit, events: list, speed: float = 1.0, parent=None):
+        super().__init__(parent)
+        self.__editor = editor
+        self.__events = events
+        self.__speed = speed
+        self.__next = 0
+        self.__start_time = 0.0
+        # How late each event was sent, in ms
+        self.lateness_ms: list[float] = []
+
+        self.__timer = QTimer(self)
+        self.__timer.setSingleShot(True)
+        self.__timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.__timer.timeout.connect(self.__send_due)
+
+    def start(self):
+        self.__next = 0
+        self.lateness_ms.clear()
+        self.__start_time = time.perf_counter()
+        self.__timer.start(0)
+
+    def __due_time(self, i: int):
+        if self.__speed <= 0:
+            return self.__start_time
+        return self.__start_time + self.__events[i][0] / self.__speed
+
+    def __send_due(self):
+        # Everything due is sent in this pass, as a busy event loop would
+        while self.__next < len(self.__events) and self.__due_time(self.__next) <= time.perf_counter():
+            if self.__speed > 0:
+                self.lateness_ms.append((time.perf_counter() - self.__due_time(self.__next)) * 1000)
+            self.__send(self.__events[self.__next])
+            self.__next += 1
+            if self.__speed <= 0:
+                break
+
+        if self.__next >= len(self.__events):
+            self.finished.emit()
+            return
+        delay = self.__due_time(self.__next) - time.perf_counter()
+        self.__timer.start(max(0, int(delay * 1000)))
+
+    def __send(self, event: tuple):
+        # Sent as QTest sends them; its PyQt binding only takes ASCII text
+        _, kind, key, modifiers, text = event
+        if kind == commit_event:
+            input_event = QInputMethodEvent()
+            input_event.setCommitString(text)
+            QApplication.sendEvent(self.__editor, input_event)
+            return
+        for event_type in (QEvent.Type.KeyPress, QEvent.Type.KeyRelease):
+            QApplication.sendEvent(self.__editor,
+                                   QKeyEvent(event_type, key, Qt.KeyboardModifier(modifiers), text))
+
+
+typing_recorder = TypingRecorder()
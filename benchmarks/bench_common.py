@@ -0,0 +1,125 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from PyQt6 import QtCore, QtWidgets
+import math
+import os
+import sys
+import time
+
+# Benchmarks run from anywhere, but the modules load assets relative to
+# the project root folder.
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+os.chdir(root_path)
+
+sample_paragraph = ("The quick brown fox jumps over the lazy dog, "
+                    "and the writer keeps typing without looking back. ") * 3
+
+
+def application():
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+    return app
+
+
+def sample_text(n_paragraphs: int):
+    return "\n".join(sample_paragraph for _ in range(n_paragraphs))
+
+
+def percentile(values: list[float], q: float):
+    # Nearest rank, so every reported time was actually measured
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def process_events():
+    # Deliver posted events, e.g. layout requests, then paint
+    QtWidgets.QApplication.sendPostedEvents()
+    QtWidgets.QApplication.processEvents()
+
+
+class SignalWaiter:
+    # Connect before starting the work, as the signal may come at once
+    def __init__(self, signal):
+        self.args = None
+        self.__signal = signal
+        self.__loop = QtCore.QEventLoop()
+        signal.connect(self.__receive)
+
+    def __receive(self, *args):
+        self.args = args
+        self.__loop.quit()
+
+    def wait(self, timeout_ms: int = 600000):
+        # Runs the event loop until the signal comes; False on timeout
+        if self.args is None:
+            timer = QtCore.QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(self.__loop.quit)
+            timer.start(timeout_ms)
+            self.__loop.exec()
+            timer.stop()
+        self.__signal.disconnect(self.__receive)
+        return self.args is not None
+
+
+class Stopwatch:
+    # Wall and CPU time of a with block, in milliseconds
+    def __init__(self):
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+
+    def __enter__(self):
+        self.__wall = time.perf_counter()
+        self.__cpu = time.process_time()
+        return self
+
+    def __exit__(self, *_):
+        self.wall_ms = (time.perf_counter() - self.__wall) * 1000
+        self.cpu_ms = (time.process_time() - self.__cpu) * 1000
+
+
+class EventCounter(QtCore.QObject):
+    # Counts the events delivered to the watched objects, by type
+    def __init__(self, *objects: QtCore.QObject):
+        super().__init__()
+        self.counts: dict[QtCore.QEvent.Type, int] = {}
+        for watched in objects:
+            watched.installEventFilter(self)
+
+    def eventFilter(self, watched: QtCore.QObject, event: QtCore.QEvent):
+        self.counts[event.type()] = self.counts.get(event.type(), 0) + 1
+        return False
+
+    def count(self, *event_types: QtCore.QEvent.Type):
+        return sum(self.counts.get(event_type, 0) for event_type in event_types)
+
+    def reset(self):
+        self.counts.clear()
+
+
+def print_table(headers: list[str], rows: list[list]):
+    cells = [[str(cell) for cell in row] for row in [headers] + rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    for i, row in enumerate(cells):
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+        if i == 0:
+            print("  ".join('-' * width for width in widths))
@@ -0,0 +1,89 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Compares the warning fade through style sheets, as it used to be, with the
+palette fade of MainEdit.set_editor_whiteness.
+
+    python benchmarks/bench_fade.py [n_paragraphs]
+"""
+
+from bench_common import EventCounter, Stopwatch, application, print_table, process_events, sample_text
+from PyQt6.QtCore import QEvent
+import sys
+
+from LibMainEdit import MainEdit
+
+
+def set_whiteness_by_style_sheet(main_edit: MainEdit, b: int):
+    main_edit.edit.setStyleSheet(
+        f"""
+            QPlainTextEdit {{
+                color: rgb({b}, {b}, {b});
+            }}
+        """
+    )
+
+
+def set_whiteness_by_palette(main_edit: MainEdit, b: int):
+    main_edit.set_editor_whiteness(b)
+
+
+def fade_steps(main_edit: MainEdit):
+    # The whiteness of every fade step between the warning and the fail
+    n_steps = round((main_edit.n_fail_seconds - main_edit.n_warning_seconds) / main_edit.fade_step_seconds)
+    return [int(i / n_steps * 255) for i in range(1, n_steps)]
+
+
+def run(name: str, set_whiteness, n_paragraphs: int):
+    main_edit = MainEdit()
+    main_edit.resize(900, 700)
+    main_edit.show()
+    main_edit.edit.setPlainText(sample_text(n_paragraphs))
+    set_whiteness(main_edit, 0)
+    process_events()
+
+    counter = EventCounter(main_edit.edit, main_edit.edit.viewport())
+    relayouts = []
+    main_edit.edit.document().documentLayout().update.connect(lambda: relayouts.append(1))
+    steps = fade_steps(main_edit)
+    with Stopwatch() as stopwatch:
+        for whiteness in steps:
+            set_whiteness(main_edit, whiteness)
+            process_events()
+
+    main_edit.close()
+    main_edit.deleteLater()
+    return [name, len(steps), counter.count(QEvent.Type.Paint),
+            counter.count(QEvent.Type.StyleChange, QEvent.Type.Polish),
+            counter.count(QEvent.Type.LayoutRequest), len(relayouts),
+            f"{stopwatch.cpu_ms:.1f}", f"{stopwatch.wall_ms:.1f}",
+            f"{stopwatch.cpu_ms / len(steps):.2f}"]
+
+
+def main():
+    n_paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app = application()
+    print(f"Fade over {n_paragraphs} paragraphs")
+    rows = [run("style sheet", set_whiteness_by_style_sheet, n_paragraphs),
+            run("palette", set_whiteness_by_palette, n_paragraphs)]
+    print_table(["fade", "steps", "frames", "re-polish", "layout requests", "document updates",
+                 "CPU ms", "wall ms", "CPU ms/step"], rows)
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Regression suite for the hot paths of the editor: keystrokes in MainEdit,
+FindDialog, FindReplaceDialog replace all, PreviewWidget renders, opening
+and saving, and the memory a document takes, for documents of 1 KB to 20 MB.
+
+    python benchmarks/bench_hot_paths.py [--sizes 1k,100k,1m,20m]
+        [--save-baseline [path]] [--check [path]] [--tolerance 0.5]
+
+--check compares with the baseline and exits with 1 if a metric regressed
+by more than the tolerance, e.g. in CI. The numbers of a baseline only hold
+on the machine which recorded it, as named in its "machine" field, so
+--check skips the comparison when that is not this machine. To check in CI,
+save a baseline on the runner once, from a known good commit, and keep it
+with the runner:
+
+    python benchmarks/bench_hot_paths.py --save-baseline ci/hot_paths.json
+    python benchmarks/bench_hot_paths.py --check ci/hot_paths.json
+
+and save it again whenever the runner's platform, Python or processor change.
+"""
+
+from bench_common import (SignalWaiter, Stopwatch, application, percentile, print_table, process_events,
+                          root_path, sample_paragraph)
+from PyQt6.QtCore import QTimer, Qt
+from PyQt6.QtGui import QTextCursor, QTextDocument
+from PyQt6.QtTest import QTest
+from PyQt6.QtWidgets import QPlainTextEdit
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+
+from LibFileIO import ChunkedFileLoader, SaveEngine
+from LibFind import FindDialog
+from LibMainEdit import MainEdit
+from LibPreview import PreviewWidget
+from LibReplace import FindReplaceDialog
+from LibSearch import find_all, valid_query
+
+default_baseline_path = os.path.join(root_path, "benchmarks", "baselines", "hot_paths.json")
+default_sizes = "1k,100k,1m,20m"
+size_units = {"k": 1000, "m": 1000 * 1000}
+
+n_keystrokes = 200
+n_repeats = 3
+# The last word of every document, so that finding it scans everything
+find_query = "zebra"
+
+# Texts and expressions on which find_all, which replace all and highlight
+# all use, must find what QTextDocument.find finds
+find_all_checks = [("a b\nb", r"a[^x]*b"), ("foo\nbar", r"o\s*"), ("line one\nline two", r"^l\w+"),
+                   ("x 😀 y\n😀 y", r"y$|😀"), ("fox\u2028fox dog\nfox", r"fox\s\w+")]
+
+# name, unit, higher is better, smallest change worth reporting
+metrics = [
+    ("keystroke p50", "ms", False, 0.5),
+    ("keystroke p99", "ms", False, 2.0),
+    ("find", "ms", False, 2.0),
+    ("replace all", "ms", False, 5.0),
+    ("preview render", "ms", False, 20.0),
+    ("preview edit", "ms", False, 20.0),
+    ("preview edit gui", "ms", False, 5.0),
+    ("preview stall", "ms", False, 8.0),
+    ("open", "MB/s", True, 0.5),
+    ("save", "MB/s", True, 0.5),
+    ("memory", "MB", False, 5.0),
+]
+
+
+def parse_size(size: str):
+    size = size.strip().lower()
+    if size[-1] in size_units:
+        return int(float(size[:-1]) * size_units[size[-1]])
+    return int(size)
+
+
+def size_label(n_bytes: int):
+    if n_bytes >= size_units["m"]:
+        return f"{n_bytes / size_units['m']:g} MB"
+    return f"{n_bytes / size_units['k']:g} KB"
+
+
+def markdown_document(n_bytes: int):
+    # Markdown paragraphs under headings, each one different so that no
+    # render cache hides the work, ending with the word find looks for
+    parts = []
+    length = 0
+    i = 0
+    while length < n_bytes:
+        part = f"## Section {i // 20}\n\n" if i % 20 == 0 else ""
+        part += f"Paragraph {i}: {sample_paragraph}\n\n"
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return "".join(parts)[:max(0, n_bytes - len(find_query))] + find_query
+
+
+def resident_mb():
+    # Resident set size now, where /proc has it, else the peak so far
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def type_keys(text: str):
+    main_edit = MainEdit()
+    main_edit.resize(900, 700)
+    main_edit.show()
+    process_events()
+    before_mb = resident_mb()
+    main_edit.edit.setPlainText(text)
+    main_edit.edit.moveCursor(QTextCursor.MoveOperation.End)
+    main_edit.edit.setFocus()
+    process_events()
+    memory_mb = resident_mb() - before_mb
+
+    # Every key is painted before the next, as when a person types
+    key_ms = []
+    for i in range(n_keystrokes):
+        key = Qt.Key.Key_Return if i % 50 == 49 else Qt.Key.Key_Space if i % 6 == 5 else Qt.Key.Key_A
+        with Stopwatch() as stopwatch:
+            QTest.keyClick(main_edit.edit, key)
+            process_events()
+        key_ms.append(stopwatch.wall_ms)
+
+    main_edit.close()
+    main_edit.deleteLater()
+    return {"keystroke p50": percentile(key_ms, 50), "keystroke p99": percentile(key_ms, 99),
+            "memory": memory_mb}
+
+
+def check_find_all():
+    for text, pattern in find_all_checks:
+        document = QTextDocument()
+        document.setPlainText(text)
+        regex = valid_query(pattern, True)
+        expected = []
+        cursor = document.find(regex, 0)
+        while not cursor.isNull():
+            expected.append((cursor.selectionStart(), cursor.selectionEnd()))
+            cursor = document.find(regex, cursor)
+        assert find_all(document, pattern, is_regex=True) == expected, f"find_all differs on {pattern}"
+
+
+def find(text: str):
+    editor = QPlainTextEdit()
+    editor.setPlainText(text)
+    find_dialog = FindDialog(editor)
+    find_dialog.lineEdit.setText(find_query)
+    times = []
+    for _ in range(n_repeats):
+        find_dialog.fromStartCheckBox.setChecked(True)
+        with Stopwatch() as stopwatch:
+            find_dialog.find()
+        assert find_dialog.last_match, "find missed the last word"
+        times.append(stopwatch.wall_ms)
+    editor.clear()
+    return {"find": statistics.median(times)}
+
+
+def replace_all(text: str):
+    editor = QPlainTextEdit()
+    replace_dialog = FindReplaceDialog(editor)
+    replace_dialog.lineEdit.setText("fox")
+    replace_dialog.replaceField.setText("cat")
+    times = []
+    for _ in range(n_repeats):
+        editor.setPlainText(text)
+        with Stopwatch() as stopwatch:
+            n_replaced = replace_dialog.replace_all()
+        assert n_replaced > 0, "replace all found nothing"
+        times.append(stopwatch.wall_ms)
+    editor.clear()
+    return {"replace all": statistics.median(times)}
+
+
+def render_preview(text: str):
+    # The first render of the document, then an edit in its middle which
+    # only renders the changed paragraph again. Besides the wall time, the
+    # time the GUI thread spent on each edit and its longest stall, in which
+    # typing would wait.
+    preview = PreviewWidget()
+    preview.show()
+    process_events()
+    stall_times = []
+
+    def render(markdown_txt: str):
+        waiter = SignalWaiter(preview.render_finished)
+        with Stopwatch() as stopwatch:
+            preview.update_preview(markdown_txt)
+            assert waiter.wait(), "the preview did not render"
+        stall_times.append(preview.last_slice_ms)
+        return stopwatch.wall_ms
+
+    full_ms = render(text)
+    middle = text.find("Paragraph", len(text) // 2)
+    edit_times = []
+    edit_gui_times = []
+    for i in range(n_repeats):
+        edited = text[:middle] + f"Edited {i} " + text[middle:] if middle >= 0 else text + f" {i}"
+        edit_times.append(render(edited))
+        edit_gui_times.append(preview.last_patch_ms)
+
+    render("")
+    preview.close()
+    return {"preview render": full_ms, "preview edit": statistics.median(edit_times),
+            "preview edit gui": statistics.median(edit_gui_times), "preview stall": max(stall_times)}
+
+
+def open_and_save(text: str):
+    # Opened as the main window does, while deadlines short enough to fail
+    # the challenge during the load are pending
+    main_edit = MainEdit()
+    main_edit.n_warning_seconds = 0.001
+    main_edit.n_fail_seconds = 0.002
+    editor = main_edit.edit
+    loader = ChunkedFileLoader(editor)
+    save_engine = SaveEngine()
+    n_megabytes = len(text.encode("utf-8")) / 2 ** 20
+    open_times = []
+    save_times = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document.md")
+        with open(path, "w", encoding="utf-8", newline='') as file:
+            file.write(text)
+        for _ in range(n_repeats):
+            QTest.keyClick(editor, Qt.Key.Key_A)
+            waiter = SignalWaiter(loader.finished)
+            with Stopwatch() as stopwatch:
+                main_edit.stop_challenge()
+                main_edit.word_counter.suspend()
+                editor.blockSignals(True)
+                loader.load(path, "utf-8")
+                assert waiter.wait(), "loading did not finish"
+            open_times.append(stopwatch.wall_ms)
+            editor.blockSignals(False)
+            main_edit.word_counter.resume()
+            assert editor.toPlainText() == text, "the opened text differs from the file"
+
+            waiter = SignalWaiter(save_engine.saved)
+            with Stopwatch() as stopwatch:
+                save_engine.save(os.path.join(directory, "saved.md"), editor.document(), "utf-8")
+                assert waiter.wait(), "saving did not finish"
+            save_times.append(stopwatch.wall_ms)
+
+    main_edit.deleteLater()
+    return {"open": n_megabytes / (statistics.median(open_times) / 1000),
+            "save": n_megabytes / (statistics.median(save_times) / 1000)}
+
+
+def run(n_bytes: int):
+    text = markdown_document(n_bytes)
+    result = {}
+    for measure in (type_keys, find, replace_all, render_preview, open_and_save):
+        result.update(measure(text))
+        process_events()
+    return result
+
+
+def machine():
+    return {"platform": platform.platform(), "python": platform.python_version(),
+            "processor": platform.processor() or platform.machine()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    # Regressions as (size, metric, baseline, now); sizes or metrics missing
+    # from either side are skipped
+    regressions = []
+    for size, values in results.items():
+        base_values = baseline.get("results", {}).get(size, {})
+        for name, _, higher_is_better, min_change in metrics:
+            if name not in values or name not in base_values:
+                continue
+            now, base = values[name], base_values[name]
+            worse = base - now if higher_is_better else now - base
+            if worse > min_change and worse > tolerance * abs(base):
+                regressions.append((size, name, base, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path benchmarks of the editor, offscreen")
+    parser.add_argument("--sizes", default=default_sizes,
+                        help=f"comma separated document sizes in bytes, k or m (default {default_sizes})")
+    parser.add_argument("--save-baseline", nargs='?', const=default_baseline_path, metavar="PATH",
+                        help="write the results as the baseline")
+    parser.add_argument("--check", nargs='?', const=default_baseline_path, metavar="PATH",
+                        help="exit with 1 if a metric regressed from the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown as a fraction of the baseline (default 0.5)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = application()
+    # Closing a benchmarked widget must not end the run
+    app.setQuitOnLastWindowClosed(False)
+    exit_codes = []
+
+    def run_and_quit():
+        try:
+            exit_codes.append(run_all(args))
+        finally:
+            app.quit()
+
+    # Inside the event loop, so that quitting stops the worker threads
+    QTimer.singleShot(0, run_and_quit)
+    app.exec()
+    sys.exit(exit_codes[0] if len(exit_codes) > 0 else 2)
+
+
+def run_all(args: argparse.Namespace):
+    check_find_all()
+    results = {}
+    for n_bytes in [parse_size(size) for size in args.sizes.split(',')]:
+        print(f"{size_label(n_bytes)}...", file=sys.stderr)
+        results[size_label(n_bytes)] = run(n_bytes)
+
+    print_table(["size"] + [f"{name} {unit}" for name, unit, _, _ in metrics],
+                [[size] + [f"{values[name]:.2f}" for name, _, _, _ in metrics] for size, values in results.items()])
+
+    exit_code = 0
+    if args.check is not None:
+        with open(args.check, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("machine") != machine():
+            # Timings of another machine say nothing about this one
+            print(f"\nNot compared with {args.check}, which was recorded on another machine, "
+                  f"{baseline.get('machine')}; save a baseline here with --save-baseline")
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            print(f"\nCompared with {args.check}, tolerance {args.tolerance:.0%}: "
+                  f"{len(regressions)} regression(s)")
+            for size, name, base, now in regressions:
+                print(f"  {size} {name}: {base:.2f} -> {now:.2f}")
+            exit_code = 1 if len(regressions) > 0 else 0
+
+    if args.save_baseline is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump({"machine": machine(),
+                       "units": {name: unit for name, unit, _, _ in metrics},
+                       "results": results}, file, indent=1)
+        print(f"\nBaseline written to {args.save_baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    main()
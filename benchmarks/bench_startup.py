@@ -0,0 +1,125 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Cold start of main_window.pyw in fresh interpreters, up to the first
+keystroke the editor handles, with the phases of the built-in startup
+profiler. Pass the root folder of another checkout to compare with an older
+revision.
+
+    python benchmarks/bench_startup.py [project_root] [n_runs]
+"""
+
+from bench_common import percentile, print_table, root_path
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Runs in the child interpreter: the milliseconds since start of each stage
+child_script = r"""
+import time
+start_time = time.perf_counter()
+import json, os, runpy, sys
+from PyQt6 import QtCore, QtTest, QtWidgets
+
+stages = {}
+
+
+def mark(stage):
+    stages.setdefault(stage, (time.perf_counter() - start_time) * 1000)
+
+
+def exec_patched(*_):
+    app = QtWidgets.QApplication.instance()
+    main_window = [w for w in app.topLevelWidgets() if isinstance(w, QtWidgets.QMainWindow)][0]
+    mark("window shown")
+    edit = main_window.main_edit.edit
+
+    def type_key():
+        QtTest.QTest.keyClick(edit, "a")
+        app.quit()
+
+    class PaintFilter(QtCore.QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QtCore.QEvent.Type.Paint and "first frame" not in stages:
+                mark("first frame")
+                # Queued behind everything left from start up, like a user
+                # who starts typing as soon as the editor shows
+                QtCore.QTimer.singleShot(0, type_key)
+            return False
+
+    paint_filter = PaintFilter()
+    edit.viewport().installEventFilter(paint_filter)
+    edit.textChanged.connect(lambda: mark("first keystroke"))
+    app_exec()
+
+    # Phases of the built-in profiler, on the same clock
+    try:
+        from LibStartupProfiler import startup_profiler
+        for phase, mark_time in startup_profiler.marks:
+            stages.setdefault(phase, (mark_time - start_time) * 1000)
+    except ImportError:
+        pass
+    print(json.dumps(stages))
+    os._exit(0)
+
+
+app_exec = QtWidgets.QApplication.exec
+QtWidgets.QApplication.exec = exec_patched
+mark("PyQt imported")
+script_path = sys.argv[1]
+sys.argv = [script_path]
+sys.path.insert(0, os.path.dirname(script_path))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def run_once(project_root: str):
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    with tempfile.TemporaryDirectory() as temp_directory:
+        environment["EASYTYPING_PROFILE_STARTUP"] = os.path.join(temp_directory, "profile.jsonl")
+        # Keep the typed key out of the real journal, or the next run would
+        # stop at the recovery question
+        environment["EASYTYPING_JOURNAL_DIRECTORY"] = os.path.join(temp_directory, "journal")
+        output = subprocess.run([sys.executable, "-c", child_script,
+                                 os.path.join(project_root, "main_window.pyw")],
+                                cwd=project_root, env=environment, capture_output=True, text=True,
+                                check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    project_root = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else root_path
+    n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    run_once(project_root)  # Warm the disk cache, compile byte code
+    runs = [run_once(project_root) for _ in range(n_runs)]
+
+    stage_times: dict[str, list[float]] = {}
+    for run in runs:
+        for stage, stage_ms in run.items():
+            stage_times.setdefault(stage, []).append(stage_ms)
+    rows = []
+    for stage, times in sorted(stage_times.items(), key=lambda item: percentile(item[1], 50)):
+        rows.append([stage, len(times)] + [f"{percentile(times, q):.1f}" for q in (50, 90, 99)] +
+                    [f"{max(times):.1f}"])
+    print(f"Cold start of {project_root}, {n_runs} runs, ms since the interpreter started")
+    print_table(["stage", "runs", "p50", "p90", "p99", "max"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+EasyTyping - a simplified notepad software
+Copyright (C) 2023 Yiming Yang
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Replays typing sessions recorded with --record-typing into MainEdit and a
+preview wired as in the main window, and counts what each session
+triggered: state machine transitions, word recounts, preview renders and
+repaints. Without session files a synthetic session is replayed. Each
+replay is also recorded with masking, and fails if that session still holds
+the key of a typed letter or digit.
+
+    python benchmarks/bench_typing_replay.py [session.jsonl ...] [--speed 1] [--words 200] [--seed 0]
+
+At --speed 4 the session plays four times faster and the deadlines of
+MainEdit shrink with it, so pauses still warn and fail as they did; the
+preview keeps its own debounce. --speed 0 sends the events back to back.
+"""
+
+from bench_common import EventCounter, SignalWaiter, application, percentile, print_table, process_events
+from PyQt6.QtCore import QEvent, QTimer, Qt
+import argparse
+import os
+import sys
+import tempfile
+
+from LibMainEdit import MainEdit
+from LibPreview import PreviewWidget
+from LibTypingReplay import (TypingRecorder, TypingReplayer, key_event, load_session, save_session,
+                             synthetic_session)
+
+
+def wait_ms(ms: int):
+    timer = QTimer()
+    timer.setSingleShot(True)
+    waiter = SignalWaiter(timer.timeout)
+    timer.start(ms)
+    waiter.wait()
+
+
+def check_masked(events: list, recorded: list):
+    # A session recorded without content must not hold the keys of the
+    # letters and digits that were typed, only X in their place
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.jsonl")
+        save_session(path, recorded)
+        _, saved = load_session(path)
+    typed_keys = {key for _, kind, key, modifiers, _ in events
+                  if kind == key_event and modifiers == 0 and key <= sys.maxunicode and chr(key).isalnum()}
+    saved_keys = {key for _, _, key, _, _ in saved}
+    assert len(saved) == len(recorded), "the session lost events"
+    assert saved_keys & typed_keys <= {Qt.Key.Key_X.value}, "the session holds the keys of typed letters"
+
+
+def replay(name: str, events: list, speed: float):
+    main_edit = MainEdit()
+    if speed > 0:
+        main_edit.n_warning_seconds = MainEdit.n_warning_seconds / speed
+        main_edit.n_fail_seconds = MainEdit.n_fail_seconds / speed
+        main_edit.fade_step_seconds = MainEdit.fade_step_seconds / speed
+    main_edit.resize(900, 700)
+    main_edit.show()
+    preview = PreviewWidget()
+    preview.show()
+    edit = main_edit.edit
+    edit.textChanged.connect(lambda: preview.request_preview(edit.document()))
+    edit.activateWindow()
+    edit.setFocus()
+    process_events()
+
+    word_recounts = []
+    edit.document().contentsChange.connect(lambda *_: word_recounts.append(1))
+    editor_paints = EventCounter(edit.viewport())
+    bar_paints = EventCounter(main_edit.bar)
+    n_renders = preview.render_count
+    main_edit.start_trace()
+    # Records what the replay types, masked as --record-typing does
+    recorder = TypingRecorder()
+    recorder.record_content = False
+    edit.installEventFilter(recorder)
+
+    replayer = TypingReplayer(edit, events, speed)
+    waiter = SignalWaiter(replayer.finished)
+    replayer.start()
+    waiter.wait(24 * 60 * 60 * 1000)
+    # Let the last preview render land
+    wait_ms(preview.max_delay_ms + 100)
+
+    trace = main_edit.stop_trace()
+    edit.removeEventFilter(recorder)
+    check_masked(events, recorder.events)
+    row = [name, len(events), f"{events[-1][0] if len(events) > 0 else 0:.1f}", len(trace),
+           sum(1 for _, _, source, target, _ in trace
+               if target == MainEdit.warning_state and source != MainEdit.warning_state),
+           sum(1 for _, _, _, target, _ in trace if target == MainEdit.failed_state),
+           len(word_recounts), preview.render_count - n_renders,
+           editor_paints.count(QEvent.Type.Paint), bar_paints.count(QEvent.Type.Paint),
+           main_edit.count_words(),
+           f"{percentile(replayer.lateness_ms, 99):.1f}" if len(replayer.lateness_ms) > 0 else "-"]
+
+    preview.close()
+    main_edit.close()
+    main_edit.deleteLater()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays typing sessions into the editor, offscreen")
+    parser.add_argument("sessions", nargs='*', help="sessions recorded with --record-typing")
+    parser.add_argument("--speed", type=float, default=1.0, help="times faster than typed, 0 for no pauses")
+    parser.add_argument("--words", type=int, default=200, help="words of the synthetic session")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic session")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = application()
+    # Closing a replayed editor must not end the run
+    app.setQuitOnLastWindowClosed(False)
+
+    def run_and_quit():
+        try:
+            rows = []
+            if len(args.sessions) == 0:
+                rows.append(replay(f"synthetic, {args.words} words",
+                                   synthetic_session(args.words, seed=args.seed), args.speed))
+            for path in args.sessions:
+                header, events = load_session(path)
+                rows.append(replay(os.path.basename(path), events, args.speed))
+            print(f"Typing replay at speed {args.speed:g}")
+            print_table(["session", "events", "typed s", "transitions", "warnings", "fails", "word recounts",
+                         "preview renders", "editor repaints", "bar repaints", "words", "late p99 ms"], rows)
+        finally:
+            app.quit()
+
+    # Inside the event loop, so that quitting stops the worker threads
+    QTimer.singleShot(0, run_and_quit)
+    app.exec()
+
+
+if __name__ == "__main__":
+    main()
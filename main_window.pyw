@@ -16,17 +16,21 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+from LibStartupProfiler import startup_profiler
+import multiprocessing
 import sys
 import os
 
 from PyQt6 import QtGui, QtCore, QtWidgets
 from PyQt6.QtCore import Qt
 from LibMainEdit import MainEdit
-from LibPreview import PreviewWidget
-from LibThesaurus import ThesaurusDictWidget
-from LibMotivation import MotivationWidget
-from LibFind import FindDialog
-from LibReplace import FindReplaceDialog
+from LibFileIO import ChunkedFileLoader, SaveEngine
+from LibJournal import EditJournal, journal_directory, recover
+from LibIconCache import load_icons
+from LibInstrumentation import instrumentation
+from LibTypingReplay import typing_recorder
+
+startup_profiler.mark("modules imported")
 
 # Change directory to project root folder
 if getattr(sys, "frozen", False):
@@ -46,6 +50,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.file_name = "untitled.md"
         self.file_encoding = "UTF-8"
         self.is_file_touched = False
+        self.edit_generation = 0
         self.setMinimumHeight(768)
 
         self.setWindowTitle(self.file_name + " - Easy Typing")
@@ -56,6 +61,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.statusBar().addWidget(self.status_label,
                                    True)
 
+        self.load_progress = QtWidgets.QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(200)
+        self.statusBar().addPermanentWidget(self.load_progress)
+        self.load_progress.hide()
+
         self.statusBar().setStyleSheet(
             """
                 QStatusBar {
@@ -71,9 +82,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.PreventContextMenu)
 
         self.__create_toolbar()
+        startup_profiler.mark("toolbar built")
         self.__create_dock_widgets()
 
         self.main_edit = MainEdit()
+        startup_profiler.mark("editor built")
 
         self.setCentralWidget(self.main_edit)
 
@@ -82,30 +95,47 @@ class MainWindow(QtWidgets.QMainWindow):
         self.__link_toolbar_slots()
         self.__link_shortcuts()
 
-        self.main_edit.edit.textChanged.connect(self.__render_markdown)
-        self.main_edit.edit.textChanged.connect(self.__update_preview_scroll)
+        instrumentation.connect(self.main_edit.edit.textChanged, self.__render_markdown, "preview request")
+        instrumentation.connect(self.main_edit.edit.textChanged, self.__update_preview_scroll, "preview scroll")
         self.main_edit.edit.verticalScrollBar().valueChanged.connect(self.__update_preview_scroll)
 
-        self.status_timer = QtCore.QTimer(self)
-        self.status_timer.start(250)
+        instrumentation.connect(self.main_edit.edit.textChanged, self.__touched_file, "title")
+        # The status only changes with the state or the word count
+        self.main_edit.state_changed.connect(self.update_status_bar)
+        instrumentation.connect(self.main_edit.edit.textChanged, self.update_status_bar, "status bar")
+
+        self.file_loader = ChunkedFileLoader(self.main_edit.edit, self)
+        self.file_loader.progress.connect(self.load_progress.setValue)
+        self.file_loader.finished.connect(self.__file_loaded)
+        self.file_loader.failed.connect(self.__file_load_failed)
 
-        self.main_edit.edit.textChanged.connect(self.__touched_file)
-        self.status_timer.timeout.connect(self.update_status_bar)
+        self.save_engine = SaveEngine(self)
+        self.save_engine.saved.connect(self.__file_saved)
+        self.save_engine.failed.connect(self.__file_save_failed)
+
+        # Journal sequence number of each save snapshot, by edit generation
+        self.__save_seqs: dict[int, int] = {}
+        # Line to jump to once the file being opened has loaded
+        self.__pending_line = 0
+        self.journal = EditJournal(self.main_edit.edit.document(), journal_directory(), parent=self)
+        QtCore.QTimer.singleShot(0, self.__recover_journal)
+        startup_profiler.mark("journal started")
 
         self.main_edit.edit.setFocus()
 
     def __create_toolbar(self, icon_size=38):
+        # Pre-rendered once into an atlas, later starts skip the SVG parser
+        icons = load_icons(["file", "internal", "download", "download.modified", "show",
+                            "cut", "copy", "paste", "search", "replace", "folder",
+                            "thesaurus", "heart"], icon_size)
+
         def add_toolbar_actions(texts: list[str],
                                 icon_filenames: list[str]):
-            path = "assets/icons/"
-            filetype = ".svg"
             for i in range(len(texts)):
                 if texts[i] == '|':
                     self.toolbar.addSeparator()
                     continue
-                icon_path = path + icon_filenames[i] + filetype
-                icon = QtGui.QIcon(icon_path)
-                self.toolbar.addAction(icon, texts[i])
+                self.toolbar.addAction(icons[icon_filenames[i]], texts[i])
 
         self.toolbar = QtWidgets.QToolBar("Toolbar", self)
         self.toolbar.setMovable(False)
@@ -120,9 +150,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.toolbar.addSeparator()
 
-        # Text: Cut, Copy, Paste, Find, Replace
-        toolbar_txt = ["Cut", "Copy", "Paste", '|', "Find", "Replace"]
-        toolbar_icon_path = ["cut", "copy", "paste", '|', "search", "replace"]
+        # Text: Cut, Copy, Paste, Find, Replace, Find in Files
+        toolbar_txt = ["Cut", "Copy", "Paste", '|', "Find", "Replace", "Find in Files"]
+        toolbar_icon_path = ["cut", "copy", "paste", '|', "search", "replace", "folder"]
         add_toolbar_actions(toolbar_txt, toolbar_icon_path)
 
         # DockWidget: Thesaurus, Motivation
@@ -134,6 +164,7 @@ class MainWindow(QtWidgets.QMainWindow):
                         self.toolbar)
 
     def __touched_file(self):
+        self.edit_generation += 1
         self.is_file_touched = True
         self.setWindowTitle('*' + os.path.basename(self.file_name) + " - Easy Typing")
 
@@ -141,20 +172,29 @@ class MainWindow(QtWidgets.QMainWindow):
         self.is_file_touched = False
         self.setWindowTitle(os.path.basename(self.file_name) + " - Easy Typing")
 
-    def __create_dock_widgets(self):
-        self.widget_preview = PreviewWidget()
-        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea,
-                           self.widget_preview)
+    def __recover_journal(self):
+        recovered = recover(self.journal.directory)
+        if recovered is None or \
+                QtWidgets.QMessageBox.question(self, " ", "Recover unsaved work from the last session?",
+                                               QtWidgets.QMessageBox.StandardButton.Yes |
+                                               QtWidgets.QMessageBox.StandardButton.No) == \
+                QtWidgets.QMessageBox.StandardButton.No:
+            self.journal.reset_to_text(self.file_name, True)
+            return
 
-        self.widget_thesaurus = ThesaurusDictWidget()
-        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea,
-                           self.widget_thesaurus)
-        self.widget_thesaurus.hide()
+        self.file_name, text = recovered
+        self.main_edit.edit.setPlainText(text)
+        self.main_edit.current_state = self.main_edit.idle_state
+        self.__touched_file()
+        self.journal.reset_to_text(self.file_name, False)
 
-        self.widget_motivation = MotivationWidget()
-        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea,
-                           self.widget_motivation)
-        self.widget_motivation.hide()
+    def __create_dock_widgets(self):
+        # Docks are built, and their modules imported, when first needed.
+        # The preview is shown from the start, but only once the window is up.
+        self.__widget_preview = None
+        self.__widget_thesaurus = None
+        self.__widget_motivation = None
+        QtCore.QTimer.singleShot(0, self.__show_preview)
 
         self.setStyleSheet(
             """
@@ -164,11 +204,80 @@ class MainWindow(QtWidgets.QMainWindow):
             """
         )
 
+    @property
+    def widget_preview(self):
+        if self.__widget_preview is None:
+            from LibPreview import PreviewWidget
+            self.__widget_preview = PreviewWidget()
+            self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea,
+                               self.__widget_preview)
+            if instrumentation.enabled:
+                # Time spent patching the preview on the GUI thread, in all and
+                # in its longest turn of the event loop
+                self.__widget_preview.render_finished.connect(self.__record_preview_patch)
+        return self.__widget_preview
+
+    def __record_preview_patch(self):
+        instrumentation.record("preview patch", self.__widget_preview.last_patch_ms)
+        instrumentation.record("preview slice", self.__widget_preview.last_slice_ms)
+
+    @property
+    def widget_thesaurus(self):
+        if self.__widget_thesaurus is None:
+            from LibThesaurus import ThesaurusDictWidget
+            self.__widget_thesaurus = ThesaurusDictWidget()
+            self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea,
+                               self.__widget_thesaurus)
+            self.__widget_thesaurus.hide()
+            self.__widget_thesaurus.watch_editor(self.main_edit.edit)
+        return self.__widget_thesaurus
+
+    @property
+    def widget_motivation(self):
+        if self.__widget_motivation is None:
+            from LibMotivation import MotivationWidget
+            self.__widget_motivation = MotivationWidget()
+            self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea,
+                               self.__widget_motivation)
+            self.__widget_motivation.hide()
+        return self.__widget_motivation
+
+    def __show_preview(self):
+        self.widget_preview.show()
+        self.__render_markdown()
+        self.__update_preview_scroll()
+        startup_profiler.mark("preview built")
+
     def __init_search_find_dialogs(self):
-        self.find_dialog = FindDialog(self.main_edit.edit, self)
-        self.find_dialog.hide()
-        self.replace_dialog = FindReplaceDialog(self.main_edit.edit, self)
-        self.replace_dialog.hide()
+        # Built on first use like the docks
+        self.__find_dialog = None
+        self.__replace_dialog = None
+        self.__find_in_files_dialog = None
+
+    @property
+    def find_dialog(self):
+        if self.__find_dialog is None:
+            from LibFind import FindDialog
+            self.__find_dialog = FindDialog(self.main_edit.edit, self)
+            self.__find_dialog.hide()
+        return self.__find_dialog
+
+    @property
+    def replace_dialog(self):
+        if self.__replace_dialog is None:
+            from LibReplace import FindReplaceDialog
+            self.__replace_dialog = FindReplaceDialog(self.main_edit.edit, self)
+            self.__replace_dialog.hide()
+        return self.__replace_dialog
+
+    @property
+    def find_in_files_dialog(self):
+        if self.__find_in_files_dialog is None:
+            from LibFindInFiles import FindInFilesDialog
+            self.__find_in_files_dialog = FindInFilesDialog(self.main_edit.edit, self)
+            self.__find_in_files_dialog.open_requested.connect(self.open_path)
+            self.__find_in_files_dialog.hide()
+        return self.__find_in_files_dialog
 
     def __link_shortcuts(self):
         shortcut_dict = {
@@ -179,6 +288,7 @@ class MainWindow(QtWidgets.QMainWindow):
             "Preview": "Ctrl+p",
             "Find": "Ctrl+f",
             "Replace": "Ctrl+r",
+            "Find in Files": "Ctrl+Shift+f",
             "Thesaurus": "Ctrl+t",
             "Motivation": "Ctrl+m"
         }
@@ -194,14 +304,15 @@ class MainWindow(QtWidgets.QMainWindow):
             "Open": self.open_file,
             "Save": self.save_file,
             "Save As": self.save_as_file,
-            "Preview": self.widget_preview.toggle_show_hide,
+            "Preview": lambda: self.widget_preview.toggle_show_hide(),
             "Cut": self.main_edit.edit.cut,
             "Copy": self.main_edit.edit.copy,
             "Paste": self.main_edit.edit.paste,
-            "Find": self.find_dialog.toggle_visibility,
-            "Replace": self.replace_dialog.toggle_visibility,
-            "Thesaurus": self.widget_thesaurus.toggle_show_hide,
-            "Motivation": self.widget_motivation.toggle_show_hide,
+            "Find": lambda: self.find_dialog.toggle_visibility(),
+            "Replace": lambda: self.replace_dialog.toggle_visibility(),
+            "Find in Files": self.__toggle_find_in_files,
+            "Thesaurus": lambda: self.widget_thesaurus.toggle_show_hide(),
+            "Motivation": lambda: self.widget_motivation.toggle_show_hide(),
         }
 
         for action in self.toolbar.actions():
@@ -211,10 +322,13 @@ class MainWindow(QtWidgets.QMainWindow):
             action.triggered.connect(slot)
 
     def __render_markdown(self):
-        markdown_text = self.main_edit.edit.toPlainText()
-        self.widget_preview.update_preview(markdown_text)
+        if self.__widget_preview is None:
+            return
+        self.widget_preview.request_preview(self.main_edit.edit.document())
 
     def __update_preview_scroll(self):
+        if self.__widget_preview is None:
+            return False
         source_min = self.main_edit.edit.verticalScrollBar().minimum()
         source_max = self.main_edit.edit.verticalScrollBar().maximum()
         if source_max == source_min:
@@ -230,6 +344,8 @@ class MainWindow(QtWidgets.QMainWindow):
         return True
 
     def new_file(self):
+        if self.file_loader.is_loading():
+            return
         if len(self.main_edit.edit.toPlainText()) == 0:
             QtWidgets.QMessageBox.information(self, " ", "No change required.")
             return
@@ -242,8 +358,31 @@ class MainWindow(QtWidgets.QMainWindow):
         self.main_edit.edit.clear()
         self.__untouched_file()
         self.main_edit.current_state = self.main_edit.idle_state
+        self.journal.reset_to_text(self.file_name, True)
+
+    def __toggle_find_in_files(self):
+        if self.file_name != "untitled.md":
+            self.find_in_files_dialog.set_folder(os.path.dirname(os.path.abspath(self.file_name)))
+        self.find_in_files_dialog.toggle_visibility()
 
     def open_file(self):
+        if self.file_loader.is_loading():
+            return
+        filename = QtWidgets.QFileDialog.getOpenFileName(self, "Open",
+                                                         os.path.join(os.path.join(os.environ['USERPROFILE']),
+                                                                      'Desktop'),
+                                                         "(*.md *.txt);;Markdown (*.md);;Plain Text (*.txt)")[0]
+        if filename == "":
+            return
+        self.open_path(filename)
+
+    def open_path(self, filename: str, line: int = 0):
+        if self.file_loader.is_loading():
+            return
+        if self.file_name != "untitled.md" and os.path.abspath(filename) == os.path.abspath(self.file_name):
+            # Already open, keep any edits
+            self.__go_to_line(line)
+            return
         if self.is_file_touched > 0 and \
                 QtWidgets.QMessageBox.question(self, " ", "Discard changes?",
                                                QtWidgets.QMessageBox.StandardButton.Yes |
@@ -251,33 +390,103 @@ class MainWindow(QtWidgets.QMainWindow):
                 QtWidgets.QMessageBox.StandardButton.No:
             return
 
-        filename = QtWidgets.QFileDialog.getOpenFileName(self, "Open",
-                                                         os.path.join(os.path.join(os.environ['USERPROFILE']),
-                                                                      'Desktop'),
-                                                         "(*.md *.txt);;Markdown (*.md);;Plain Text (*.txt)")[0]
-        if filename == "":
+        # Hold off word counting, the state machine and the preview until
+        # the whole file has streamed in.
+        self.main_edit.stop_challenge()
+        self.main_edit.word_counter.suspend()
+        self.journal.suspend()
+        self.main_edit.edit.blockSignals(True)
+        self.main_edit.edit.setReadOnly(True)
+        try:
+            self.file_loader.load(filename, self.file_encoding)
+        except OSError as e:
+            self.__end_loading()
+            self.journal.resume()
+            QtWidgets.QMessageBox.warning(self, "Error", f"Cannot open {filename}: {e.strerror}")
             return
 
         self.file_name = filename
+        self.__pending_line = line
         self.setWindowTitle(os.path.basename(filename) + " - Easy Typing")
-        with open(filename, "r", encoding=self.file_encoding, errors="ignore") as f:
-            self.main_edit.edit.clear()
-            self.main_edit.edit.appendPlainText("".join(f.readlines()))
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+
+    def __end_loading(self):
+        self.load_progress.hide()
+        self.main_edit.edit.setReadOnly(False)
+        self.main_edit.edit.blockSignals(False)
+        self.main_edit.word_counter.resume()
+
+    def __file_loaded(self):
+        self.__end_loading()
+        self.main_edit.bar.bar_color = "black"
+        self.main_edit.update_progress_bar()
         self.main_edit.current_state = self.main_edit.idle_state
+        self.__render_markdown()
         self.__untouched_file()
+        self.journal.reset_to_file(self.file_name, self.file_encoding)
+        self.__go_to_line(self.__pending_line)
+
+    def __go_to_line(self, line: int):
+        # Line numbers start at 1, 0 leaves the cursor where it is
+        block = self.main_edit.edit.document().findBlockByNumber(line - 1)
+        if line <= 0 or not block.isValid():
+            return
+        cursor = self.main_edit.edit.textCursor()
+        cursor.setPosition(block.position())
+        self.main_edit.edit.setTextCursor(cursor)
+        self.main_edit.edit.centerCursor()
+        self.main_edit.edit.setFocus()
+
+    def __file_load_failed(self, message: str):
+        # Keep the partial text, but never save it over the original file
+        self.__end_loading()
+        self.file_name = "untitled.md"
+        self.main_edit.update_progress_bar()
+        self.main_edit.current_state = self.main_edit.idle_state
+        self.__render_markdown()
+        self.__touched_file()
+        self.journal.reset_to_text(self.file_name, False)
+        QtWidgets.QMessageBox.warning(self, "Error", message)
 
     def __write_file(self):
-        with open(self.file_name, "wb") as f:
-            f.write(self.main_edit.edit.toPlainText().encode(self.file_encoding, "ignore"))
+        self.__save_seqs[self.edit_generation] = self.journal.sequence()
+        self.save_engine.save(self.file_name, self.main_edit.edit.document(),
+                              self.file_encoding, self.edit_generation)
+
+    def __pop_save_seq(self, generation: int):
+        # Saves collapsed into a later one never report back
+        seq = self.__save_seqs.get(generation, 0)
+        self.__save_seqs = {g: s for g, s in self.__save_seqs.items() if g > generation}
+        return seq
+
+    def __file_saved(self, path: str, n_written: int, seconds: float, mode: str, generation: int):
+        seq = self.__pop_save_seq(generation)
+        if path == self.file_name:
+            self.journal.mark_saved(path, seq)
+        # Edits made while the save was running keep the file touched
+        if path == self.file_name and generation == self.edit_generation:
+            self.__untouched_file()
+        self.statusBar().showMessage(f"Saved {os.path.basename(path)}: {n_written} bytes "
+                                     f"written ({mode}) in {seconds * 1000:.1f} ms.", 3000)
+
+    def __file_save_failed(self, path: str, message: str, generation: int):
+        self.__pop_save_seq(generation)
+        if path == self.file_name:
+            self.__touched_file()
+        QtWidgets.QMessageBox.warning(self, "Error", message)
 
     def save_file(self):
+        if self.file_loader.is_loading():
+            return
         if self.file_name == "untitled.md":
             self.save_as_file()
             return
         self.__write_file()
-        self.__untouched_file()
 
     def save_as_file(self):
+        if self.file_loader.is_loading():
+            return
         filename = QtWidgets.QFileDialog.getSaveFileName(self, "Save As",
                                                          os.path.join(os.path.join(os.environ['USERPROFILE']),
                                                                       'Desktop'),
@@ -285,8 +494,8 @@ class MainWindow(QtWidgets.QMainWindow):
         if filename == "":
             return
         self.file_name = filename
+        self.setWindowTitle('*' + os.path.basename(self.file_name) + " - Easy Typing")
         self.__write_file()
-        self.__untouched_file()
         self.main_edit.current_state = self.main_edit.idle_state
 
     def update_status_bar(self):
@@ -305,7 +514,17 @@ class MainWindow(QtWidgets.QMainWindow):
             pass
 
 
-app = QtWidgets.QApplication(sys.argv)
-main_window = MainWindow()
-main_window.show()
-app.exec()
+if __name__ == "__main__":
+    # The Find in Files indexer starts worker processes, which import this
+    # module again on Windows and in frozen builds.
+    multiprocessing.freeze_support()
+    app = QtWidgets.QApplication(sys.argv)
+    startup_profiler.mark("application created")
+    main_window = MainWindow()
+    startup_profiler.mark("main window built")
+    startup_profiler.watch(main_window.main_edit.edit)
+    instrumentation.watch_editor(main_window.main_edit.edit)
+    typing_recorder.watch(main_window.main_edit.edit)
+    main_window.show()
+    startup_profiler.mark("window shown")
+    app.exec()